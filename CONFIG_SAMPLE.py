@@ -11,6 +11,13 @@ class CONFIG(object):
     GCP_PROJECT_PREFIX = 'company-'
     EMAIL_FROM = 'Cloud Team <cloud@company.com>'
     EMAIL_DOMAIN = 'company.com'
+    SUPPRESS_HOURS = {
+        'info': 24,
+        'warning': 12,
+        'critical': 4
+    }
+    SNAPSHOT_DAYS = 90
+    CACHE_TTL = 300
     AZURE_CLIENT_ID = 'xxx'
     AZURE_SECRET = 'xxx'
     AZURE_TENANT = 'xxx'
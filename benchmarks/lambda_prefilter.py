@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark of CloudTrail record parsing in the auto-tag Lambda.
+
+Author: Peter Pakos <peter.pakos@wandisco.com>
+
+Copyright (C) 2019 WANdisco
+"""
+
+from __future__ import print_function
+import os
+import io
+import sys
+import gzip
+import json
+import time
+import random
+import argparse
+
+LAMBDA_FUNCTION = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'lambda_function')
+
+SKIPPED_EVENTS = ['DescribeInstances', 'DescribeVolumes', 'GetBucketAcl', 'ListBuckets', 'AssumeRole',
+                  'DescribeAutoScalingGroups', 'GetObject', 'ListClusters', 'DescribeSecurityGroups']
+
+
+def load_lambda_function():
+    try:
+        from importlib.machinery import SourceFileLoader
+        return SourceFileLoader('lambda_function', LAMBDA_FUNCTION).load_module()
+    except ImportError:
+        import imp
+        return imp.load_source('lambda_function', LAMBDA_FUNCTION)
+
+
+def synthetic_record(i, handled_ratio):
+    handled = random.random() < handled_ratio
+    event_name = 'RunInstances' if handled else random.choice(SKIPPED_EVENTS)
+    return {
+        'eventVersion': '1.05',
+        'userIdentity': {
+            'type': 'IAMUser',
+            'principalId': 'AIDA%016d' % i,
+            'arn': 'arn:aws:iam::123456789012:user/user%s' % (i % 50),
+            'accountId': '123456789012',
+            'userName': 'user%s' % (i % 50),
+            'sessionContext': {'attributes': {'mfaAuthenticated': 'false', 'creationDate': '2019-01-01T00:00:00Z'}}
+        },
+        'eventTime': '2019-01-01T%02d:%02d:%02dZ' % (i // 3600 % 24, i // 60 % 60, i % 60),
+        'eventSource': 'ec2.amazonaws.com',
+        'eventName': event_name,
+        'awsRegion': random.choice(['us-east-1', 'eu-west-1', 'ap-southeast-2']),
+        'sourceIPAddress': '10.0.%s.%s' % (i // 256 % 256, i % 256),
+        'userAgent': 'aws-cli/1.16.0 Python/2.7.15 Linux/4.15.0 botocore/1.12.0',
+        'requestParameters': {'filterSet': {'items': [{'name': 'tag:Name', 'valueSet': {'items': [
+            {'value': 'instance-%s' % i}]}}]}},
+        'responseElements': {'instancesSet': {'items': [{'instanceId': 'i-%017x' % i}]}} if handled else None,
+        'requestID': '%08x-0000-0000-0000-%012x' % (i, i),
+        'eventID': '%08x-1111-1111-1111-%012x' % (i, i),
+        'eventType': 'AwsApiCall',
+        'recipientAccountId': '123456789012'
+    }
+
+
+def synthetic_trail(size_mb, handled_ratio):
+    records = []
+    size = 0
+    while size < size_mb * 1024 * 1024:
+        record = json.dumps(synthetic_record(len(records), handled_ratio), separators=(',', ':'))
+        records.append(record)
+        size += len(record) + 1
+    raw = ('{"Records":[' + ','.join(records) + ']}').encode('utf-8')
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb') as f:
+        f.write(raw)
+    return out.getvalue(), len(raw), len(records)
+
+
+def bench(name, func, data, raw_size, total):
+    started = time.time()
+    parsed = func(data)
+    elapsed = time.time() - started
+    print('%-24s %8.2fs %10.0f records/s %8.1f MB/s %8s records decoded' %
+          (name, elapsed, total / elapsed, raw_size / elapsed / 1024 / 1024, parsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CloudTrail parsing in lambda_function')
+    parser.add_argument('-s', '--size', help='trail size (MB, uncompressed, default: %(default)s)', dest='size',
+                        default=50, type=int)
+    parser.add_argument('-r', '--handled-ratio', help='ratio of handled events (default: %(default)s)',
+                        dest='handled_ratio', default=0.02, type=float)
+    args = parser.parse_args()
+
+    random.seed(0)
+    lambda_function = load_lambda_function()
+    data, raw_size, total = synthetic_trail(args.size, args.handled_ratio)
+    print('Trail: %.1f MB (%.1f MB gzipped), %s records, %.0f%% handled' %
+          (raw_size / 1024.0 / 1024, len(data) / 1024.0 / 1024, total, args.handled_ratio * 100))
+
+    def load_all(data):
+        return len(json.loads(gzip.GzipFile(fileobj=io.BytesIO(data)).read().decode('utf-8'))['Records'])
+
+    def stream(data):
+        return len(list(lambda_function.iter_records(lambda_function.read_chunks(io.BytesIO(data)))))
+
+    def prefilter(data):
+        return len(list(lambda_function.iter_records(lambda_function.read_chunks(io.BytesIO(data)),
+                                                     lambda_function.EventHandler.EVENT_NAMES)))
+
+    bench('json.loads (whole file)', load_all, data, raw_size, total)
+    bench('streaming', stream, data, raw_size, total)
+    bench('streaming + pre-filter', prefilter, data, raw_size, total)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
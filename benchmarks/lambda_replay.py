@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Replay local CloudTrail logs through the auto-tag Lambda with stubbed AWS clients.
+
+Author: Peter Pakos <peter.pakos@wandisco.com>
+
+Copyright (C) 2019 WANdisco
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import argparse
+import threading
+import prettytable
+from lambda_prefilter import load_lambda_function
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+OK = {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+
+class StubClient(object):
+    PAGE_SIZE = 50
+
+    def __init__(self, session, service, region):
+        self._session = session
+        self._service = service
+        self._region = region
+
+    def _call(self, operation):
+        self._session.record('%s.%s' % (self._service, operation))
+
+    def __getattr__(self, operation):
+        def call(*args, **kwargs):
+            self._call(operation)
+            return dict(OK)
+        return call
+
+    def get_object(self, Bucket, Key):
+        self._call('get_object')
+        return {'Body': open(Key, 'rb')}
+
+    def describe_spot_instance_requests(self, SpotInstanceRequestIds):
+        self._call('describe_spot_instance_requests')
+        return dict(OK, SpotInstanceRequests=[{'SpotInstanceRequestId': sir, 'InstanceId': 'i-%s' % sir[4:]}
+                                              for sir in SpotInstanceRequestIds])
+
+    def list_instances(self, ClusterId, Marker=None, **kwargs):
+        self._call('list_instances')
+        start = int(Marker or 0)
+        end = min(start + self.PAGE_SIZE, self._session.cluster_size)
+        response = dict(OK, Instances=[{'Ec2InstanceId': 'i-%s%05d' % (ClusterId[2:], i)} for i in range(start, end)])
+        if end < self._session.cluster_size:
+            response['Marker'] = str(end)
+        return response
+
+    def describe_auto_scaling_groups(self, AutoScalingGroupNames, **kwargs):
+        self._call('describe_auto_scaling_groups')
+        return dict(OK, AutoScalingGroups=[{
+            'AutoScalingGroupName': name,
+            'Instances': [{'InstanceId': 'i-%s%05d' % (abs(hash(name)) % 10 ** 8, i)}
+                          for i in range(self._session.cluster_size)]
+        } for name in AutoScalingGroupNames])
+
+    def describe_tags(self, Filters=None, NextToken=None):
+        self._call('describe_tags')
+        return dict(OK, Tags=[{'ResourceId': name, 'ResourceType': 'auto-scaling-group', 'Key': 'Last_user',
+                               'Value': user} for name, user in self._session.asg_tags.items()])
+
+    def get_item(self, TableName, Key):
+        self._call('get_item')
+        item = self._session.items.get(Key['asg']['S'])
+        return dict(OK, Item=item) if item else dict(OK)
+
+    def put_item(self, TableName, Item):
+        self._call('put_item')
+        self._session.items[Item['asg']['S']] = Item
+        return dict(OK)
+
+
+class StubSession(object):
+    def __init__(self, latency=0, cluster_size=5, asg_tags=None):
+        self.latency = latency
+        self.cluster_size = cluster_size
+        self.asg_tags = asg_tags or {}
+        self.items = {}
+        self.event_name = None
+        self.calls = {}
+        self.clients = 0
+        self._lock = threading.Lock()
+
+    def client(self, service, region_name=None, **kwargs):
+        with self._lock:
+            self.clients += 1
+        return StubClient(self, service, region_name)
+
+    def record(self, operation):
+        with self._lock:
+            key = (self.event_name or '(setup)', operation)
+            self.calls[key] = self.calls.get(key, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+def find_logs(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                for name in sorted(files):
+                    if name.endswith('.gz'):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024.0 / 1024.0 if sys.platform == 'darwin' else rss / 1024.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay CloudTrail logs through lambda_function with stubbed AWS')
+    parser.add_argument('paths', help='gzip CloudTrail log files or directories', nargs='+')
+    parser.add_argument('-b', '--bucket', help='log bucket name (default: %(default)s)', dest='bucket',
+                        default='wandisco-replay-auto-tag')
+    parser.add_argument('-l', '--latency', help='simulated API latency (ms, default: %(default)s)', dest='latency',
+                        default=0, type=float)
+    parser.add_argument('-n', '--cluster-size', help='instances per EMR cluster/ASG (default: %(default)s)',
+                        dest='cluster_size', default=5, type=int)
+    parser.add_argument('-t', '--asg-tag', help='Last_user tag returned by describe_tags (ASG=USER)',
+                        action='append', dest='asg_tags', default=[])
+    parser.add_argument('--table', help='enable DynamoDB ASG user store with given table name', dest='table')
+    parser.add_argument('-v', '--verbose', help='show handler output', action='store_true', dest='verbose')
+    args = parser.parse_args()
+
+    if args.table:
+        os.environ['ASG_USERS_TABLE'] = args.table
+    lambda_function = load_lambda_function()
+    session = StubSession(args.latency / 1000.0, args.cluster_size,
+                          dict(tag.split('=', 1) for tag in args.asg_tags))
+    lambda_function.boto3.Session = lambda *a, **kw: session
+
+    handled = {}
+    handle = lambda_function.EventHandler.handle
+    resolve = lambda_function.EventHandler.resolve
+    flush = lambda_function.TagBatch.flush
+
+    def counting_handle(self, event):
+        session.event_name = event['eventName']
+        handled[event['eventName']] = handled.get(event['eventName'], 0) + 1
+        return handle(self, event)
+
+    def counting_resolve(self):
+        session.event_name = '(resolve)'
+        return resolve(self)
+
+    def counting_flush(self):
+        session.event_name = '(flush)'
+        return flush(self)
+
+    lambda_function.EventHandler.handle = counting_handle
+    lambda_function.EventHandler.resolve = counting_resolve
+    lambda_function.TagBatch.flush = counting_flush
+
+    logs = list(find_logs(args.paths))
+    records = 0
+    for log in logs:
+        with open(log, 'rb') as f:
+            for _ in lambda_function.iter_records(lambda_function.read_chunks(f)):
+                records += 1
+
+    if tracemalloc:
+        tracemalloc.start()
+    stdout = sys.stdout
+    if not args.verbose:
+        sys.stdout = open(os.devnull, 'w')
+    started = time.time()
+    try:
+        for log in logs:
+            session.event_name = None
+            lambda_function.lambda_handler({'Records': [{'s3': {'bucket': {'name': args.bucket},
+                                                                'object': {'key': log}}}]}, None)
+    finally:
+        elapsed = time.time() - started
+        if not args.verbose:
+            sys.stdout.close()
+        sys.stdout = stdout
+    heap_peak = tracemalloc.get_traced_memory()[1] / 1024.0 / 1024.0 if tracemalloc else None
+
+    print('Files: %s | Records: %s | Decoded events: %s | Time: %.2fs' %
+          (len(logs), records, sum(handled.values()), elapsed))
+    print('Throughput: %.0f records/s | Peak RSS: %s | Peak Python heap: %s' % (
+        records / elapsed if elapsed else 0,
+        '%.1f MB' % peak_rss_mb() if resource else 'n/a',
+        '%.1f MB' % heap_peak if heap_peak is not None else 'n/a'
+    ))
+    print('Clients created: %s | API calls: %s' % (session.clients, sum(session.calls.values())))
+
+    table = prettytable.PrettyTable(['Event', 'Events', 'API call', 'Calls'], sortby='Event')
+    table.align = 'l'
+    for (event_name, operation), count in session.calls.items():
+        table.add_row([event_name, handled.get(event_name, ''), operation, count])
+    for event_name in set(handled) - set([event_name for (event_name, operation) in session.calls]):
+        table.add_row([event_name, handled[event_name], '', 0])
+    print(table)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
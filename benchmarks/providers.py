@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark of provider listings and alerting against stubbed cloud backends.
+
+Author: Peter Pakos <peter.pakos@wandisco.com>
+
+Copyright (C) 2019 WANdisco
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import datetime
+import tempfile
+import threading
+import iso8601
+import prettytable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import wdcloud  # noqa: E402
+import wdnotify  # noqa: E402
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+AWS_REGIONS = ['us-east-1', 'eu-west-1', 'ap-southeast-2']
+GCP_ZONES = ['us-east1-b', 'us-east1-c', 'europe-west1-b', 'europe-west1-d', 'asia-east1-a']
+AZURE_REGIONS = ['eastus', 'westeurope', 'southeastasia']
+STATES = ['running'] * 7 + ['stopped'] * 2 + ['terminated']
+USERS = 50
+
+
+class Recorder(object):
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def record(self, service, operation):
+        with self._lock:
+            key = (service, operation)
+            self.calls[key] = self.calls.get(key, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def operation(self, service, operation, result):
+        def call(*args, **kwargs):
+            self.record(service, operation)
+            return result(*args, **kwargs) if callable(result) else list(result)
+        return call
+
+
+class Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class SinkMailer(object):
+    recorder = None
+
+    def __init__(self, slack=False):
+        self.sent = []
+
+    def send(self, **kwargs):
+        self.recorder.record('ppmail', 'send')
+        self.sent.append(kwargs)
+        return True
+
+
+def timestamp(i):
+    then = datetime.datetime(2019, 1, 1) + datetime.timedelta(seconds=i * 37 % (86400 * 30))
+    return then.strftime('%Y-%m-%dT%H:%M:%S.000-07:00')
+
+
+def aws_instance(i, region):
+    tags = [{'Key': 'Name', 'Value': 'instance-%05d' % i}, {'Key': 'Last_user', 'Value': 'user%s' % (i % USERS)}]
+    if i % 20 == 0:
+        tags.append({'Key': 'EXCLUDE', 'Value': 'True'})
+    return {
+        'InstanceId': 'i-%017x' % i,
+        'ImageId': 'ami-%08x' % (i % 40),
+        'InstanceType': 'm5.xlarge',
+        'KeyName': 'user%s' % (i % USERS),
+        'LaunchTime': iso8601.parse_date(timestamp(i)),
+        'Placement': {'AvailabilityZone': region + 'a'},
+        'PrivateIpAddress': '10.0.%s.%s' % (i // 256 % 256, i % 256),
+        'PublicIpAddress': '54.1.%s.%s' % (i // 256 % 256, i % 256),
+        'State': {'Code': 16, 'Name': STATES[i % len(STATES)]},
+        'Tags': tags
+    }
+
+
+def aws_backend(size, recorder):
+    import boto3
+    import wdaws
+    from botocore.stub import Stubber
+
+    page_size = 1000
+    session = boto3.session.Session(aws_access_key_id='bench', aws_secret_access_key='bench',
+                                    region_name=AWS_REGIONS[0])
+
+    def count(model=None, **kwargs):
+        recorder.record('ec2', model.name)
+
+    def stub(client):
+        client.meta.events.register('before-parameter-build.*.*', count)
+        stubber = Stubber(client)
+        stubber.activate()
+        return stubber
+
+    ec2c = session.client('ec2')
+    stub(ec2c).add_response('describe_regions', {'Regions': [{'RegionName': region} for region in AWS_REGIONS]})
+    resources = {}
+    for index, region in enumerate(AWS_REGIONS):
+        resources[region] = session.resource('ec2', region_name=region)
+        stubber = stub(resources[region].meta.client)
+        instances = [aws_instance(i, region) for i in range(index, size, len(AWS_REGIONS))]
+        for start in range(0, max(len(instances), 1), page_size):
+            page = instances[start:start + page_size]
+            response = {'Reservations': [{'ReservationId': 'r-%08x' % start, 'Instances': page}] if page else []}
+            if start + page_size < len(instances):
+                response['NextToken'] = str(start + page_size)
+            stubber.add_response('describe_instances', response)
+            for instance in page:
+                stubber.add_response('describe_images', {'Images': [{'ImageId': instance['ImageId'],
+                                                                     'Name': 'centos-7-%s' % instance['ImageId']}]})
+
+    session.client = lambda *args, **kwargs: ec2c
+    session.resource = lambda service, region_name=None, **kwargs: resources[region_name]
+    wdaws.boto3.Session = lambda *args, **kwargs: session
+    cloud = wdaws.AWS('aws', 'bench', refresh=True)
+    return lambda: cloud.list(warning_threshold=12, critical_threshold=24)
+
+
+class StubRequest(object):
+    def __init__(self, recorder, operation, response):
+        self._recorder = recorder
+        self._operation = operation
+        self._response = response
+
+    def execute(self, *args, **kwargs):
+        self._recorder.record('compute', self._operation)
+        return self._response
+
+
+class StubCollection(object):
+    def __init__(self, recorder, name, items):
+        self._recorder = recorder
+        self._name = name
+        self._items = items
+
+    def list(self, zone=None, **kwargs):
+        items = self._items(zone) if callable(self._items) else self._items
+        return StubRequest(self._recorder, self._name + '.list', {'items': items})
+
+
+def gcp_backend(size, recorder):
+    import wdgcp
+
+    instances = dict((zone, []) for zone in GCP_ZONES)
+    operations = dict((zone, []) for zone in GCP_ZONES)
+    for i in range(size):
+        zone = GCP_ZONES[i % len(GCP_ZONES)]
+        instance_id = str(10 ** 15 + i)
+        instances[zone].append({
+            'id': instance_id,
+            'name': 'instance-%05d' % i,
+            'status': STATES[i % len(STATES)].upper(),
+            'machineType': 'zones/%s/machineTypes/n1-standard-4' % zone,
+            'disks': [{'licenses': ['projects/centos-cloud/global/licenses/centos-7']}],
+            'networkInterfaces': [{'networkIP': '10.0.%s.%s' % (i // 256 % 256, i % 256),
+                                   'accessConfigs': [{'natIP': '35.1.%s.%s' % (i // 256 % 256, i % 256)}]}],
+            'creationTimestamp': timestamp(i)
+        })
+        operations[zone].append({'targetId': instance_id, 'status': 'DONE', 'operationType': 'start',
+                                 'user': 'user%s@company.com' % (i % USERS), 'endTime': timestamp(i + 3600)})
+    compute = Obj(
+        zones=lambda: StubCollection(recorder, 'zones', [{'name': zone} for zone in GCP_ZONES]),
+        instances=lambda: StubCollection(recorder, 'instances', lambda zone: instances[zone]),
+        zoneOperations=lambda: StubCollection(recorder, 'zoneOperations', lambda zone: operations[zone])
+    )
+    wdgcp.discovery.build = lambda *args, **kwargs: compute
+    wdgcp.GoogleCredentials.get_application_default = staticmethod(lambda: None)
+    cloud = wdgcp.GCP('gcp', 'default', refresh=True)
+    return lambda: cloud.list(warning_threshold=12, critical_threshold=24)
+
+
+def azure_backend(size, recorder):
+    import wdazure
+
+    now = int(time.time())
+    vms = []
+    views = []
+    nics = []
+    pips = []
+    logs = []
+    for i in range(size):
+        rg = 'dev-rg%s' % (i % 20)
+        vm_id = '/subscriptions/bench/resourceGroups/%s/providers/Microsoft.Compute/virtualMachines/vm%05d' % (rg, i)
+        nic_id = '/subscriptions/bench/resourceGroups/%s/providers/Microsoft.Network/networkInterfaces/nic%05d' % (
+            rg, i)
+        pip_id = '/subscriptions/bench/resourceGroups/%s/providers/Microsoft.Network/publicIPAddresses/pip%05d' % (
+            rg, i)
+        state = STATES[i % len(STATES)]
+        vms.append(Obj(
+            id=vm_id,
+            name='vm%05d' % i,
+            location=AZURE_REGIONS[i % len(AZURE_REGIONS)],
+            tags={'EXCLUDE': 'True'} if i % 20 == 0 else None,
+            hardware_profile=Obj(vm_size='Standard_D4s_v3'),
+            storage_profile=Obj(image_reference=Obj(offer='CentOS', sku='7.5')),
+            network_profile=Obj(network_interfaces=[Obj(id=nic_id)])
+        ))
+        views.append(Obj(id=vm_id, instance_view=Obj(
+            statuses=[Obj(display_status='Provisioning succeeded', time=None),
+                      Obj(display_status='VM %s' % ('running' if state == 'running' else 'deallocated'))],
+            disks=[Obj(statuses=[Obj(time=iso8601.parse_date(timestamp(i)))])]
+        )))
+        nics.append(Obj(id=nic_id, ip_configurations=[
+            Obj(private_ip_address='10.0.%s.%s' % (i // 256 % 256, i % 256), public_ip_address=Obj(id=pip_id))
+        ]))
+        pips.append(Obj(id=pip_id, ip_address='52.1.%s.%s' % (i // 256 % 256, i % 256)))
+        logs.append(Obj(event_data_id='event-%s' % i, caller='user%s@company.com' % (i % USERS),
+                        resource_id=vm_id, operation_name=Obj(value='Microsoft.Compute/virtualMachines/start/action'),
+                        event_timestamp=datetime.datetime.fromtimestamp(now - i * 60, iso8601.UTC)))
+
+    def list_all(status_only=None):
+        return list(views if status_only else vms)
+
+    virtual_machines = Obj(list_all=recorder.operation('compute', 'virtual_machines.list_all', list_all))
+    wdazure.ServicePrincipalCredentials = lambda *args, **kwargs: None
+    wdazure.SubscriptionClient = lambda *args, **kwargs: Obj(subscriptions=Obj(
+        list_locations=recorder.operation('resource', 'subscriptions.list_locations',
+                                          [Obj(name=region) for region in AZURE_REGIONS])))
+    wdazure.ComputeManagementClient = lambda *args, **kwargs: Obj(virtual_machines=virtual_machines)
+    wdazure.ResourceManagementClient = lambda *args, **kwargs: Obj()
+    wdazure.NetworkManagementClient = lambda *args, **kwargs: Obj(
+        network_interfaces=Obj(list_all=recorder.operation('network', 'network_interfaces.list_all', nics)),
+        public_ip_addresses=Obj(list_all=recorder.operation('network', 'public_ip_addresses.list_all', pips)))
+    wdazure.MonitorClient = lambda *args, **kwargs: Obj(activity_logs=Obj(
+        list=recorder.operation('monitor', 'activity_logs.list', logs)))
+    wdazure.HDInsightManagementClient = lambda *args, **kwargs: Obj()
+    cloud = wdazure.AZURE('azure', 'bench', refresh=True)
+    return lambda: cloud.list(warning_threshold=12, critical_threshold=24)
+
+
+class StubCloud(wdcloud.WDCloud):
+    def list(self, *args, **kwargs):
+        raise NotImplementedError
+
+    def tag(self, *args, **kwargs):
+        raise NotImplementedError
+
+    def sg(self, *args, **kwargs):
+        raise NotImplementedError
+
+    def public_buckets(self, *args, **kwargs):
+        raise NotImplementedError
+
+    def create_image(self, *args, **kwargs):
+        raise NotImplementedError
+
+    def run(self, *args, **kwargs):
+        raise NotImplementedError
+
+    def stop(self, *args, **kwargs):
+        raise NotImplementedError
+
+    def start(self, *args, **kwargs):
+        raise NotImplementedError
+
+    def terminate(self, *args, **kwargs):
+        raise NotImplementedError
+
+    def list_hdi(self, *args, **kwargs):
+        raise NotImplementedError
+
+
+def alerts_backend(size, recorder):
+    cloud = StubCloud('aws', 'bench')
+    inventory = wdcloud.Inventory(12, 24, notify=True)
+    for i in range(size):
+        seconds = i * 37 % (86400 * 3)
+        inventory.add(wdcloud.Record(
+            region=AWS_REGIONS[i % len(AWS_REGIONS)],
+            iid='i-%017x' % i,
+            name='instance-%05d' % i,
+            user='user%s' % (i % max(size // 5, 1)),
+            state='running',
+            seconds=seconds,
+            uptime=cloud._get_uptime(seconds)
+        ))
+    return lambda: cloud._apply(inventory, 12, 24)
+
+
+BENCHMARKS = [
+    ('aws', aws_backend),
+    ('gcp', gcp_backend),
+    ('azure', azure_backend),
+    ('alerts', alerts_backend)
+]
+
+
+def measure(backend, size, latency, trace=False):
+    recorder = Recorder(latency)
+    cache_dir = tempfile.mkdtemp(prefix='cloud_tools-bench-')
+    wdcloud.WDCloud.CACHE_DIR = cache_dir
+    SinkMailer.recorder = recorder
+    stdout = sys.stdout
+    try:
+        sys.stdout = open(os.devnull, 'w')
+        func = backend(size, recorder)
+        recorder.calls = {}
+        if trace:
+            tracemalloc.start()
+        started = time.time()
+        try:
+            func()
+        finally:
+            elapsed = time.time() - started
+            peak = None
+            if trace:
+                peak = tracemalloc.get_traced_memory()[1] / 1024.0 / 1024.0
+                tracemalloc.stop()
+            sys.stdout.close()
+            sys.stdout = stdout
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return elapsed, recorder.calls, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark provider listings and alerts against stubbed backends')
+    parser.add_argument('-b', '--benchmark', help='benchmark to run (default: all)', action='append',
+                        dest='benchmarks', choices=[name for name, _ in BENCHMARKS])
+    parser.add_argument('-s', '--sizes', help='inventory sizes (default: %(default)s)', dest='sizes',
+                        default='100,1000,10000')
+    parser.add_argument('-l', '--latency', help='simulated API latency (ms, default: %(default)s)', dest='latency',
+                        default=0, type=float)
+    parser.add_argument('-M', '--no-memory', help='skip the traced run measuring peak memory',
+                        action='store_false', dest='memory')
+    parser.add_argument('-c', '--calls', help='show API calls per operation', action='store_true', dest='calls')
+    args = parser.parse_args()
+
+    wdcloud.Mailer = SinkMailer
+    wdnotify.Mailer = SinkMailer
+    random.seed(0)
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    table = prettytable.PrettyTable(['Benchmark', 'Size', 'Time', 'Per item', 'API calls', 'Peak heap'])
+    table.align = 'r'
+    table.align['Benchmark'] = 'l'
+    calls_table = prettytable.PrettyTable(['Benchmark', 'Size', 'Service', 'Operation', 'Calls'])
+    calls_table.align = 'l'
+    for name, backend in BENCHMARKS:
+        if args.benchmarks and name not in args.benchmarks:
+            continue
+        for size in sizes:
+            try:
+                elapsed, calls, _ = measure(backend, size, args.latency / 1000.0)
+                peak = None
+                if args.memory and tracemalloc:
+                    peak = measure(backend, size, args.latency / 1000.0, trace=True)[2]
+            except ImportError as e:
+                table.add_row([name, size, 'skipped (%s)' % e, '', '', ''])
+                break
+            table.add_row([name, size, '%.3fs' % elapsed, '%.3fms' % (elapsed * 1000 / size),
+                           sum(calls.values()), '%.1f MB' % peak if peak is not None else 'n/a'])
+            for (service, operation), count in sorted(calls.items()):
+                calls_table.add_row([name, size, service, operation, count])
+            print('%s %s done' % (name, size), file=sys.stderr)
+
+    print(table)
+    if args.calls:
+        print(calls_table)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark of uptime formatting and threshold classification.
+
+Author: Peter Pakos <peter.pakos@wandisco.com>
+
+Copyright (C) 2019 WANdisco
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import wduptime  # noqa: E402
+
+
+def per_row_uptime(seconds):
+    y = divmod(seconds, 86400*364)
+    w = divmod(y[1], 86400*7)
+    d = divmod(w[1], 86400)
+    h = divmod(d[1], 3600)
+    m = divmod(h[1], 60)
+    s = m[1]
+    uptime = []
+    if y[0] > 0:
+        uptime.append('%dy' % y[0])
+    if w[0] > 0:
+        uptime.append('%dw' % w[0])
+    if d[0] > 0:
+        uptime.append('%dd' % d[0])
+    if h[0] > 0:
+        uptime.append('%dh' % h[0])
+    if m[0] > 0:
+        uptime.append('%dm' % m[0])
+    uptime.append('%ds' % s)
+    uptime = ' '.join(uptime)
+    return uptime
+
+
+def per_row(seconds, warning_threshold, critical_threshold):
+    uptimes = []
+    severities = []
+    for value in seconds:
+        if value is None:
+            uptimes.append('')
+            severities.append(None)
+            continue
+        uptimes.append(per_row_uptime(value))
+        if value >= critical_threshold * 3600:
+            severities.append(2)
+        elif value >= warning_threshold * 3600:
+            severities.append(1)
+        else:
+            severities.append(0)
+    return uptimes, severities
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark uptime classification')
+    parser.add_argument('-n', '--rows', help='number of rows (default: %(default)s)', dest='rows', default=100000,
+                        type=int)
+    parser.add_argument('-r', '--repeat', help='repetitions (default: %(default)s)', dest='repeat', default=5,
+                        type=int)
+    args = parser.parse_args()
+
+    random.seed(0)
+    seconds = [None if random.random() < 0.3 else random.random() * 86400 * 60 for _ in range(args.rows)]
+    paths = [('per-row', lambda: per_row(seconds, 12, 24)),
+             ('python', lambda: wduptime.Classifier(12, 24, use_numpy=False).classify(seconds))]
+    if wduptime.numpy is not None:
+        paths.append(('numpy', lambda: wduptime.Classifier(12, 24).classify(seconds)))
+
+    expected = paths[0][1]()
+    for name, func in paths:
+        assert func() == expected, name
+        best = None
+        for _ in range(args.repeat):
+            started = time.time()
+            func()
+            elapsed = time.time() - started
+            best = elapsed if best is None else min(best, elapsed)
+        print('%-8s %8.3fs %10.0f rows/s' % (name, best, args.rows / best))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
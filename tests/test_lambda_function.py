@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""Tests of CloudTrail log parsing in the auto-tag Lambda function.
+
+Author: Peter Pakos <peter.pakos@wandisco.com>
+
+Copyright (C) 2019 WANdisco
+"""
+
+import io
+import os
+import json
+import zlib
+import unittest
+
+LAMBDA_FUNCTION = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'lambda_function')
+
+try:
+    from importlib.machinery import SourceFileLoader
+    lambda_function = SourceFileLoader('lambda_function', LAMBDA_FUNCTION).load_module()
+except ImportError:
+    import imp
+    lambda_function = imp.load_source('lambda_function', LAMBDA_FUNCTION)
+
+EVENT_NAMES = frozenset(['RunInstances', 'StartInstances', 'CreateAutoScalingGroup'])
+
+RECORDS = [
+    u'{"eventVersion":"1.05","eventName":"RunInstances","userIdentity":{"userName":"alice"}}',
+    u'{"eventVersion":"1.05","eventName":"DescribeInstances","userIdentity":{"userName":"bob"}}',
+    u'{"eventVersion":"1.05","eventName":"ListBuckets","requestParameters":{"eventName":"RunInstances"}}',
+    u'{"eventVersion":"1.05","eventName":"DescribeVolumes","userIdentity":{"userName":"bob"}}',
+    u'{ "eventName" : "StartInstances", "eventVersion" : "1.05", "userIdentity" : { "userName" : "carol" } }',
+    u'{"eventVersion":"1.05","requestParameters":{"eventName":"DescribeInstances"},'
+    u'"eventName":"CreateAutoScalingGroup","userIdentity":{"userName":"dave"}}',
+    u'{"eventVersion":"1.05","eventName":"StartInstances","userIdentity":{"userName":"José 日本 \U0001f600"}}',
+    u'{"eventVersion":"1.05","eventName":"AssumeRole","userIdentity":{"userName":"ééé"}}',
+    u'{ "eventName" : "GetObject", "eventVersion" : "1.05" }',
+    u'{"eventVersion":"1.05","eventName":"RunInstances","userIdentity":{"userName":"erin"}}'
+]
+
+TEXT = u'{"Records": [\n' + u',\n'.join(RECORDS) + u'\n]}'
+RAW = TEXT.encode('utf-8')
+EXPECTED = [json.loads(record) for record in RECORDS]
+SKIPPED = [1, 7, 8]
+
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def gzip_members(data, members):
+    out = b''
+    for part in split(data, len(data) // members + 1):
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        out += compressor.compress(part) + compressor.flush()
+    return out
+
+
+class IterRecordsTest(unittest.TestCase):
+    def assertSubsequence(self, expected, records):
+        it = iter(records)
+        for record in expected:
+            self.assertIn(record, it)
+
+    def test_all_records(self):
+        for size in [1, 2, 3, 64 * 1024]:
+            self.assertEqual(EXPECTED, list(lambda_function.iter_records(split(RAW, size))), size)
+
+    def test_prefilter(self):
+        records = list(lambda_function.iter_records([RAW], EVENT_NAMES))
+        self.assertEqual([record for i, record in enumerate(EXPECTED) if i not in SKIPPED], records)
+
+    def test_prefilter_chunks(self):
+        relevant = [record for record in EXPECTED if record['eventName'] in EVENT_NAMES]
+        for size in [1, 2, 3, 64 * 1024]:
+            records = list(lambda_function.iter_records(split(RAW, size), EVENT_NAMES))
+            self.assertSubsequence(relevant, records)
+            self.assertSubsequence(records, EXPECTED)
+
+    def test_not_event_version_first(self):
+        for size in [1, 64 * 1024]:
+            records = list(lambda_function.iter_records(split(RAW, size), EVENT_NAMES))
+            self.assertIn(EXPECTED[4], records)
+
+    def test_nested_event_name(self):
+        for size in [1, 64 * 1024]:
+            records = list(lambda_function.iter_records(split(RAW, size), EVENT_NAMES))
+            self.assertIn(EXPECTED[5], records)
+
+    def test_multibyte(self):
+        for size in [1, 2, 3]:
+            records = list(lambda_function.iter_records(split(RAW, size), EVENT_NAMES))
+            names = [record.get('userIdentity', {}).get('userName') for record in records]
+            self.assertIn(u'José 日本 \U0001f600', names)
+
+    def test_empty(self):
+        self.assertEqual([], list(lambda_function.iter_records([b'{"Records":[]}'])))
+
+    def test_truncated(self):
+        for raw in [RAW[:len(RAW) // 2], RAW[:-2], RAW[:5]]:
+            for event_names in [None, EVENT_NAMES]:
+                for size in [1, 64 * 1024]:
+                    self.assertRaises(ValueError, list, lambda_function.iter_records(split(raw, size), event_names))
+
+    def test_gzip_members(self):
+        for members in [1, 3]:
+            for size in [1, 64 * 1024]:
+                chunks = lambda_function.read_chunks(io.BytesIO(gzip_members(RAW, members)), size)
+                self.assertEqual(EXPECTED, list(lambda_function.iter_records(chunks)))
+
+    def test_truncated_gzip(self):
+        data = gzip_members(RAW, 1)
+        chunks = lambda_function.read_chunks(io.BytesIO(data[:len(data) // 2]), 64 * 1024)
+        self.assertRaises(ValueError, list, lambda_function.iter_records(chunks))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""Tests of ALL class with stubbed cloud providers.
+
+Author: Peter Pakos <peter.pakos@wandisco.com>
+
+Copyright (C) 2019 WANdisco
+"""
+
+from __future__ import print_function
+import os
+import sys
+import types
+import shutil
+import tempfile
+import datetime
+import unittest
+import prettytable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import wdcloud  # noqa: E402
+import wdnotify  # noqa: E402
+
+
+class StubMailer(object):
+    def __init__(self, slack=False):
+        pass
+
+    def send(self, **kwargs):
+        return True
+
+
+def stub_provider(provider, regions, records):
+    class Provider(wdcloud.WDCloud):
+        def __init__(self, *args, **kwargs):
+            super(Provider, self).__init__(*args, **kwargs)
+            if regions is None:
+                exit(1)
+            self._regions.extend(regions)
+            self.stopped = []
+            self.streams = []
+
+        def _instances(self, local_tz, now, state=None, tag=None, *args, **kwargs):
+            for record in records:
+                yield wdcloud.Record(**record)
+
+        def _stop_resources(self, stop_dict, resource='instance', stream=None):
+            self.stopped.append(stop_dict)
+            self.streams.append(stream)
+
+        def list(self, *args, **kwargs):
+            raise NotImplementedError
+
+        def tag(self, *args, **kwargs):
+            raise NotImplementedError
+
+        def sg(self, *args, **kwargs):
+            raise NotImplementedError
+
+        def public_buckets(self, *args, **kwargs):
+            raise NotImplementedError
+
+        def create_image(self, *args, **kwargs):
+            raise NotImplementedError
+
+        def run(self, *args, **kwargs):
+            raise NotImplementedError
+
+        def stop(self, *args, **kwargs):
+            raise NotImplementedError
+
+        def start(self, *args, **kwargs):
+            raise NotImplementedError
+
+        def terminate(self, *args, **kwargs):
+            raise NotImplementedError
+
+        def list_hdi(self, *args, **kwargs):
+            raise NotImplementedError
+
+    module = types.ModuleType('wd' + provider)
+    setattr(module, provider.upper(), Provider)
+    return module
+
+
+class Output(object):
+    def __init__(self):
+        self.lines = []
+
+    def write(self, text):
+        self.lines.append(text)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return ''.join(self.lines)
+
+
+class ALLTest(unittest.TestCase):
+    def setUp(self):
+        self._cache_dir = wdcloud.WDCloud.CACHE_DIR
+        self._mailers = wdcloud.Mailer, wdnotify.Mailer
+        self._modules = dict((name, sys.modules.get(name)) for name in ['wdaws', 'wdgcp', 'wdazure'])
+        wdcloud.WDCloud.CACHE_DIR = tempfile.mkdtemp()
+        wdcloud.Mailer = wdnotify.Mailer = StubMailer
+        self.install('aws', ['eu-west-1'], [
+            dict(region='eu-west-1', iid='i-1', name='web', user='alice', state='running', seconds=100 * 3600,
+                 launch_time='2019-01-01 00:00:00', stop_key='eu-west-1', row=[]),
+            dict(region='eu-west-1', iid='i-2', name='db', user='bob', state='stopped', excluded=True, row=[])
+        ])
+        self.install('gcp', ['us-east1'], [
+            dict(region='us-east1', iid='123', name='build', user='carol', state='running', seconds=3600,
+                 launch_time='2019-01-02 00:00:00', stop_key='us-east1', row=[])
+        ])
+        self.install('azure', ['westeurope'], [])
+
+    def tearDown(self):
+        shutil.rmtree(wdcloud.WDCloud.CACHE_DIR, ignore_errors=True)
+        wdcloud.WDCloud.CACHE_DIR = self._cache_dir
+        wdcloud.Mailer, wdnotify.Mailer = self._mailers
+        for name, module in self._modules.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+
+    @staticmethod
+    def install(provider, regions, records):
+        sys.modules['wd' + provider] = stub_provider(provider, regions, records)
+
+    def test_regions(self):
+        cloud = wdcloud.WDCloud.loader('all', 'infra')
+        self.assertEqual(['AWS', 'GCP', 'Azure'], [c._cloud_name for c in cloud._clouds])
+        self.assertEqual(['AWS/eu-west-1', 'GCP/us-east1', 'Azure/westeurope'], cloud._regions)
+
+    def test_subset(self):
+        cloud = wdcloud.WDCloud.loader('aws,gcp', 'infra')
+        self.assertEqual(['AWS', 'GCP'], [c._cloud_name for c in cloud._clouds])
+
+    def test_failed_provider(self):
+        self.install('gcp', None, [])
+        self.assertRaises(SystemExit, wdcloud.WDCloud.loader, 'all', 'infra')
+
+    def test_list(self):
+        cloud = wdcloud.WDCloud.loader('all', 'infra')
+        stdout = sys.stdout
+        sys.stdout = output = Output()
+        try:
+            cloud.list(warning_threshold=12, critical_threshold=24, stop=True, output='csv')
+        finally:
+            sys.stdout = stdout
+        lines = output.getvalue().splitlines()
+        self.assertEqual('Cloud,Region,ID,Name,State,Launch time,Uptime,User,Exclude', lines[0])
+        self.assertIn('AWS,eu-west-1,i-1,web,running,2019-01-01 00:00:00,4d 4h 0s,alice,No', lines)
+        self.assertIn('AWS,eu-west-1,i-2,db,stopped,,,bob,Yes', lines)
+        self.assertIn('GCP,us-east1,123,build,running,2019-01-02 00:00:00,1h 0s,carol,No', lines)
+        self.assertEqual([{'eu-west-1': ['i-1']}], cloud._clouds[0].stopped)
+        self.assertEqual([sys.stderr], cloud._clouds[0].streams)
+        self.assertEqual([], cloud._clouds[1].stopped)
+        self.assertFalse([line for line in lines if line.startswith('Time:')])
+
+    def list(self, cloud):
+        stdout = sys.stdout
+        sys.stdout = output = Output()
+        try:
+            cloud.list(warning_threshold=12, critical_threshold=24, output='csv')
+        finally:
+            sys.stdout = stdout
+        return output.getvalue().splitlines()
+
+    def test_snapshot_fresh_only(self):
+        cloud = wdcloud.WDCloud.loader('all', 'infra')
+        self.list(cloud)
+        self.list(cloud)
+        self.assertEqual(1, len(cloud._snapshots.runs(cloud._cloud_name, 'infra', 'instance', limit=10)))
+
+    def test_cached_uptime(self):
+        cloud = wdcloud.WDCloud.loader('all', 'infra')
+        self.list(cloud)
+        aws = cloud._clouds[0]
+        name = aws._response_cache('instances', None, None)
+        data = aws._load_cache(name)
+        data['saved_at'] -= 60
+        aws._save_cache(name, data)
+        lines = self.list(cloud)
+        self.assertIn('AWS,eu-west-1,i-1,web,running,2019-01-01 00:00:00,4d 4h 1m 0s,alice,No', lines)
+        self.assertIn('AWS,eu-west-1,i-2,db,stopped,,,bob,Yes', lines)
+
+    def test_stream_rows(self):
+        cloud = wdcloud.WDCloud.loader('aws', 'infra')
+        table = prettytable.PrettyTable(['Region', 'ID', 'Uptime'])
+        stdout = sys.stdout
+        sys.stdout = output = Output()
+
+        def records():
+            for i in range(3):
+                self.assertEqual(i + 1, len(output.getvalue().splitlines()))
+                yield wdcloud.Record(region='eu-west-1', iid='i-%s' % i, name='', user='', state='running',
+                                     seconds=60 * i, row=['eu-west-1', 'i-%s' % i, ''])
+
+        try:
+            cloud._report(records(), table, None, datetime.datetime.now(), 12, 24, output='csv', snapshot=False)
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(['Region,ID,Uptime', 'eu-west-1,i-0,0s', 'eu-west-1,i-1,1m 0s', 'eu-west-1,i-2,2m 0s'],
+                         output.getvalue().splitlines())
+
+
+if __name__ == '__main__':
+    unittest.main()
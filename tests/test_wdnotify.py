@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""Tests of notification suppression and dispatching.
+
+Author: Peter Pakos <peter.pakos@wandisco.com>
+
+Copyright (C) 2019 WANdisco
+"""
+
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import wdnotify  # noqa: E402
+from wdnotify import Dispatcher, NotificationStore  # noqa: E402
+
+
+class StubMailer(object):
+    lock = threading.Lock()
+    sent = []
+    failures = {}
+
+    def __init__(self, slack=False):
+        pass
+
+    def send(self, sender, recipients, subject, message, code=False, cc=None):
+        with self.lock:
+            self.sent.append(recipients)
+            failures = self.failures.get(recipients, 0)
+            if failures and failures != 'always':
+                self.failures[recipients] = failures - 1
+        if failures:
+            raise Exception('Connection refused')
+        return True
+
+
+class Output(object):
+    def __init__(self):
+        self.lines = []
+
+    def write(self, text):
+        self.lines.append(text)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return ''.join(self.lines)
+
+
+class NotificationStoreTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.store = NotificationStore(os.path.join(self._dir, 'notifications', 'notifications.db'),
+                                       {'info': 0, 'warning': 24, 'critical': 2})
+
+    def tearDown(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def age(self, hours):
+        db = self.store._connect()
+        db.execute('UPDATE notifications SET sent_at = sent_at - ?', (int(hours * 3600),))
+        db.commit()
+
+    def test_not_sent(self):
+        self.assertFalse(self.store.suppressed('infra', 'alice', 'warning', ['i-1']))
+
+    def test_repeated(self):
+        self.store.record('infra', 'alice', 'warning', ['i-1', 'i-2'])
+        self.assertTrue(self.store.suppressed('infra', 'alice', 'warning', ['i-1', 'i-2']))
+        self.assertFalse(self.store.suppressed('infra', 'bob', 'warning', ['i-1', 'i-2']))
+        self.assertFalse(self.store.suppressed('dev', 'alice', 'warning', ['i-1', 'i-2']))
+
+    def test_escalation(self):
+        self.store.record('infra', 'alice', 'warning', ['i-1'])
+        self.assertFalse(self.store.suppressed('infra', 'alice', 'critical', ['i-1']))
+        self.store.record('infra', 'alice', 'critical', ['i-1'])
+        self.assertTrue(self.store.suppressed('infra', 'alice', 'critical', ['i-1']))
+        self.assertTrue(self.store.suppressed('infra', 'alice', 'warning', ['i-1']))
+
+    def test_changed_instances(self):
+        self.store.record('infra', 'alice', 'critical', ['i-1', 'i-2'])
+        self.assertFalse(self.store.suppressed('infra', 'alice', 'critical', ['i-1']))
+        self.assertFalse(self.store.suppressed('infra', 'alice', 'critical', ['i-1', 'i-2', 'i-3']))
+        self.assertFalse(self.store.suppressed('infra', 'alice', 'critical', ['i-1', 'i-3']))
+
+    def test_window(self):
+        self.store.record('infra', 'alice', 'critical', ['i-1'])
+        self.age(1.5)
+        self.assertTrue(self.store.suppressed('infra', 'alice', 'critical', ['i-1']))
+        self.age(1)
+        self.assertFalse(self.store.suppressed('infra', 'alice', 'critical', ['i-1']))
+
+    def test_window_per_severity(self):
+        self.store.record('infra', 'alice', 'critical', ['i-1'])
+        self.age(3)
+        self.assertFalse(self.store.suppressed('infra', 'alice', 'critical', ['i-1']))
+        self.assertTrue(self.store.suppressed('infra', 'alice', 'warning', ['i-1']))
+        self.assertFalse(self.store.suppressed('infra', 'alice', 'info', ['i-1']))
+        self.age(22)
+        self.assertFalse(self.store.suppressed('infra', 'alice', 'warning', ['i-1']))
+
+    def test_unknown_severity(self):
+        self.store.record('infra', 'alice', 'warning', ['i-1'])
+        self.assertFalse(self.store.suppressed('infra', 'alice', 'unknown', ['i-1']))
+
+
+class DispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._mailer = wdnotify.Mailer
+        self._retry_delay = Dispatcher.RETRY_DELAY
+        wdnotify.Mailer = StubMailer
+        Dispatcher.RETRY_DELAY = 0
+        StubMailer.sent = []
+        StubMailer.failures = {}
+        self.store = NotificationStore(os.path.join(self._dir, 'notifications.db'),
+                                       {'info': 0, 'warning': 24, 'critical': 2})
+
+    def tearDown(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+        wdnotify.Mailer = self._mailer
+        Dispatcher.RETRY_DELAY = self._retry_delay
+
+    @staticmethod
+    def queue(dispatcher, recipient, mail_type='warning', instances=None):
+        dispatcher.queue(mail_type, 'cloud-tools@wandisco.com', recipient, 'Subject', 'Message', key='infra',
+                         instances=instances or ['i-1'])
+
+    def flush(self, dispatcher, **kwargs):
+        stdout = sys.stdout
+        sys.stdout = output = Output()
+        try:
+            result = dispatcher.flush(**kwargs)
+        finally:
+            sys.stdout = stdout
+        return result, output.getvalue().splitlines()
+
+    def test_summary(self):
+        dispatcher = Dispatcher(workers=4, store=self.store)
+        recipients = ['user%s@wandisco.com' % i for i in range(8)]
+        for recipient in recipients:
+            self.queue(dispatcher, recipient)
+        StubMailer.failures['user3@wandisco.com'] = 'always'
+        result, lines = self.flush(dispatcher)
+        self.assertEqual((7, 1), result)
+        self.assertEqual(['Sending warning notification to %s... %s' %
+                          (recipient, 'FAIL' if recipient == 'user3@wandisco.com' else 'SUCCESS')
+                          for recipient in recipients] + ['Notifications: 7 sent, 1 failed'], lines)
+
+    def test_retry(self):
+        dispatcher = Dispatcher(workers=1, store=self.store)
+        self.queue(dispatcher, 'alice@wandisco.com')
+        StubMailer.failures['alice@wandisco.com'] = Dispatcher.RETRIES - 1
+        result, lines = self.flush(dispatcher)
+        self.assertEqual((1, 0), result)
+        self.assertEqual(['alice@wandisco.com'] * Dispatcher.RETRIES, StubMailer.sent)
+
+    def test_retries_exhausted(self):
+        dispatcher = Dispatcher(workers=1, store=self.store)
+        self.queue(dispatcher, 'alice@wandisco.com')
+        StubMailer.failures['alice@wandisco.com'] = Dispatcher.RETRIES
+        result, lines = self.flush(dispatcher)
+        self.assertEqual((0, 1), result)
+        self.assertEqual(['alice@wandisco.com'] * Dispatcher.RETRIES, StubMailer.sent)
+        self.assertEqual('Notifications: 0 sent, 1 failed', lines[-1])
+        self.assertFalse(self.store.suppressed('infra', 'alice@wandisco.com', 'warning', ['i-1']))
+
+    def test_suppressed(self):
+        dispatcher = Dispatcher(workers=2, store=self.store)
+        self.queue(dispatcher, 'alice@wandisco.com')
+        self.queue(dispatcher, 'bob@wandisco.com')
+        self.assertEqual((2, 0), self.flush(dispatcher)[0])
+        StubMailer.sent = []
+        self.queue(dispatcher, 'alice@wandisco.com')
+        self.queue(dispatcher, 'bob@wandisco.com', mail_type='critical')
+        result, lines = self.flush(dispatcher)
+        self.assertEqual((1, 0), result)
+        self.assertEqual(['bob@wandisco.com'], StubMailer.sent)
+        self.assertEqual('Suppressing warning notification to alice@wandisco.com (already sent)', lines[0])
+
+    def test_all_suppressed(self):
+        dispatcher = Dispatcher(workers=2, store=self.store)
+        self.queue(dispatcher, 'alice@wandisco.com')
+        self.flush(dispatcher)
+        self.queue(dispatcher, 'alice@wandisco.com')
+        self.assertEqual((0, 0), self.flush(dispatcher)[0])
+
+    def test_resend(self):
+        dispatcher = Dispatcher(workers=2, store=self.store)
+        self.queue(dispatcher, 'alice@wandisco.com')
+        self.flush(dispatcher)
+        StubMailer.sent = []
+        self.queue(dispatcher, 'alice@wandisco.com')
+        self.assertEqual((1, 0), self.flush(dispatcher, resend=True)[0])
+        self.assertEqual(['alice@wandisco.com'], StubMailer.sent)
+
+    def test_no_key(self):
+        dispatcher = Dispatcher(workers=1, store=self.store)
+        for _ in range(2):
+            dispatcher.queue('warning', 'cloud-tools@wandisco.com', 'alice@wandisco.com', 'Subject', 'Message')
+            self.assertEqual((1, 0), self.flush(dispatcher)[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
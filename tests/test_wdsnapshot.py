@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Tests of the local inventory snapshot store.
+
+Author: Peter Pakos <peter.pakos@wandisco.com>
+
+Copyright (C) 2019 WANdisco
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from wdcloud import Record  # noqa: E402
+from wdsnapshot import SnapshotStore  # noqa: E402
+
+
+def record(iid, seconds=None):
+    return Record(region='eu-west-1', iid=iid, name=iid, user='alice', state='running' if seconds else 'stopped',
+                  seconds=seconds, launch_time='2019-01-01 00:00:00')
+
+
+class SnapshotStoreTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, 'snapshots.db')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def test_save(self):
+        store = SnapshotStore(self._path)
+        run_id = store.save('AWS', 'infra', 'instance', [record('i-1', 3600), record('i-2')], taken_at=1000)
+        self.assertEqual([(run_id, 1000)], store.runs('AWS', 'infra', 'instance', before=2000))
+        instances = store.instances(run_id)
+        self.assertEqual(['i-1', 'i-2'], sorted(instances))
+        self.assertEqual(1, instances['i-1'][5])
+        self.assertEqual(0, instances['i-2'][5])
+
+    def test_concurrent_runs(self):
+        first = SnapshotStore(self._path).start('AWS', 'infra', 'instance', taken_at=1000)
+        first.add(record('i-1', 3600))
+        other = SnapshotStore(self._path)
+        other.save('GCP', 'infra', 'instance', [record('123', 60)], taken_at=1001)
+        first.add(record('i-2'))
+        run_id = first.close()
+        self.assertEqual(['i-1', 'i-2'], sorted(other.instances(run_id)))
+        self.assertEqual(1, len(other.runs('GCP', 'infra', 'instance', before=2000)))
+
+    def test_discard(self):
+        store = SnapshotStore(self._path)
+        run = store.start('AWS', 'infra', 'instance', taken_at=1000)
+        run.add(record('i-1', 3600))
+        self.assertIsNone(run.close(False))
+        self.assertEqual([], store.runs('AWS', 'infra', 'instance', before=2000))
+
+    def test_retention(self):
+        store = SnapshotStore(self._path, retention_days=1)
+        old = store.save('AWS', 'infra', 'instance', [record('i-1', 3600)], taken_at=1000)
+        new = store.save('AWS', 'infra', 'instance', [record('i-1', 3600)], taken_at=1000 + 2 * 86400)
+        self.assertEqual([(new, 1000 + 2 * 86400)], store.runs('AWS', 'infra', 'instance', before=10 ** 6, limit=10))
+        self.assertEqual({}, store.instances(old))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""This module provides ALL class operating several clouds at once.
+
+Author: Peter Pakos <peter.pakos@wandisco.com>
+
+Copyright (C) 2019 WANdisco
+"""
+
+from __future__ import print_function
+import prettytable
+
+import logging
+from wdcloud import WDCloud
+
+log = logging.getLogger('cloud_tools')
+
+
+class ALL(WDCloud):
+    def __init__(self, cloud_provider, profile_name, refresh=False, cached=False):
+        super(ALL, self).__init__(cloud_provider, profile_name, refresh=refresh, cached=cached)
+        providers = self.PROVIDERS if cloud_provider == 'all' else cloud_provider.split(',')
+
+        def load(provider):
+            try:
+                return WDCloud.loader(provider, self._profile_name, refresh=refresh, cached=cached)
+            except SystemExit:
+                return None
+
+        self._clouds = self._map(load, providers)
+        if None in self._clouds:
+            log.critical('Unable to load cloud provider(s): %s' %
+                         ', '.join([p for p, cloud in zip(providers, self._clouds) if cloud is None]))
+            exit(1)
+
+        for cloud in self._clouds:
+            for region in cloud._regions:
+                self._regions.append('%s/%s' % (cloud._cloud_name, region))
+
+    @property
+    def _replayed(self):
+        return any(cloud._replayed for cloud in self._clouds)
+
+    def list(self, disable_border=False, disable_header=False, state=None, notify=False, stop=False,
+             warning_threshold=None, critical_threshold=None, tag=None, *args, **kwargs):
+        table = prettytable.PrettyTable(['Cloud', 'Region', 'ID', 'Name', 'State', 'Launch time', 'Uptime', 'User',
+                                         'Exclude'],
+                                        border=not disable_border, header=not disable_header, reversesort=True,
+                                        sortby='Launch time')
+        table.align = 'l'
+        local_tz, now = self._clock()
+        self._report(self._instances(local_tz, now, state, tag), table, local_tz, now, warning_threshold,
+                     critical_threshold, notify=notify, stop=stop, snapshot=not (state or tag), **kwargs)
+
+    def _instances(self, local_tz, now, state=None, tag=None, *args, **kwargs):
+        def fetch(cloud):
+            return cloud, list(cloud._cached_instances(local_tz, now, state, tag))
+
+        for cloud, records in self._pipeline(self._clouds, fetch, workers=len(self._clouds)):
+            for record in records:
+                record.row = [cloud._cloud_name, record.region, record.iid, record.name, record.state,
+                              record.launch_time, record.uptime, record.user, 'Yes' if record.excluded else 'No']
+                record.region = '%s/%s' % (cloud._cloud_name, record.region)
+                if record.stop_key is not None:
+                    record.stop_key = (cloud, record.stop_key)
+                yield record
+
+    def _stop_resources(self, stop_dict, resource='instance', stream=None):
+        for cloud in self._clouds:
+            cloud_stop_dict = dict((key, iids) for ((c, key), iids) in stop_dict.items() if c is cloud)
+            if cloud_stop_dict:
+                cloud._stop_resources(cloud_stop_dict, resource, stream)
+
+    def tag(self, *args, **kwargs):
+        log.critical('Command not implemented')
+        exit(1)
+
+    def sg(self, *args, **kwargs):
+        log.critical('Command not implemented')
+        exit(1)
+
+    def public_buckets(self, *args, **kwargs):
+        log.critical('Command not implemented')
+        exit(1)
+
+    def create_image(self, *args, **kwargs):
+        log.critical('Command not implemented')
+        exit(1)
+
+    def run(self, *args, **kwargs):
+        log.critical('Command not implemented')
+        exit(1)
+
+    def stop(self, *args, **kwargs):
+        log.critical('Command not implemented')
+        exit(1)
+
+    def start(self, *args, **kwargs):
+        log.critical('Command not implemented')
+        exit(1)
+
+    def terminate(self, *args, **kwargs):
+        log.critical('Command not implemented')
+        exit(1)
+
+    def list_hdi(self, *args, **kwargs):
+        log.critical('Command not implemented')
+        exit(1)
@@ -8,12 +8,13 @@ Copyright (C) 2019 WANdisco
 
 from __future__ import print_function
 import os
-import datetime
 import boto3
 import botocore.exceptions
 import prettytable
-import tzlocal
 import wdcloud
+import wdoutput
+import wdtrace
+from wdtime import Clock
 
 import logging
 
@@ -27,6 +28,7 @@ class AWS(wdcloud.WDCloud):
         ec2c = None
         try:
             self._session = boto3.Session(profile_name=self._profile_name)
+            wdtrace.instrument_boto3(self._session)
         except botocore.exceptions.ProfileNotFound as err:
             print(err)
             exit(1)
@@ -35,18 +37,18 @@ class AWS(wdcloud.WDCloud):
         except botocore.exceptions.NoRegionError as err:
             print(err)
             exit(1)
-        regions = None
-        try:
-            regions = ec2c.describe_regions()
-        except botocore.exceptions.EndpointConnectionError as err:
-            print(err)
-            exit(1)
-        except botocore.exceptions.ClientError as err:
-            print(err)
-            exit(1)
 
-        for region in regions['Regions']:
-            self._regions.append(region['RegionName'])
+        def describe_regions():
+            try:
+                return [region['RegionName'] for region in ec2c.describe_regions()['Regions']]
+            except botocore.exceptions.EndpointConnectionError as err:
+                print(err)
+                exit(1)
+            except botocore.exceptions.ClientError as err:
+                print(err)
+                exit(1)
+
+        self._regions.extend(self._read_through('regions', describe_regions))
 
     @staticmethod
     def _get_tag(list_a, search_key):
@@ -60,30 +62,26 @@ class AWS(wdcloud.WDCloud):
 
     def list(self, disable_border=False, disable_header=False, state=None, notify=False, stop=False,
              warning_threshold=None, critical_threshold=None, tag=None, *args, **kwargs):
-        tag_key = None
-        tag_value = None
-        if tag:
-            tag_key = tag.partition(':')[0]
-            tag_value = tag.partition(':')[2]
-
-        if not state:
-            state = ['running', 'pending', 'shutting-down', 'stopped', 'stopping', 'terminated']
         table = prettytable.PrettyTable(['Zone', 'ID', 'Name', 'Type', 'Image', 'State',
                                          'Launch time', 'Uptime', 'User', 'SSH key', 'Private IP', 'Public IP',
                                          'Exclude'],
                                         border=not disable_border, header=not disable_header, reversesort=True,
                                         sortby='Launch time')
         table.align = 'l'
-        i = 0
-        states_dict = {}
-        uptime_dict = {}
-        name_dict = {}
-        stop_dict = {}
-        info_dict = {}
-        warning_dict = {}
-        critical_dict = {}
-        local_tz = tzlocal.get_localzone()
-        now = local_tz.localize(datetime.datetime.now())
+        local_tz, now = self._clock()
+        self._report(self._cached_instances(local_tz, now, state, tag), table, local_tz, now, warning_threshold,
+                     critical_threshold, notify=notify, stop=stop, snapshot=not (state or tag), **kwargs)
+
+    def _instances(self, local_tz, now, state=None, tag=None, *args, **kwargs):
+        if not state:
+            state = ['running', 'pending', 'shutting-down', 'stopped', 'stopping', 'terminated']
+        tag_key = None
+        tag_value = None
+        if tag:
+            tag_key = tag.partition(':')[0]
+            tag_value = tag.partition(':')[2]
+        clock = Clock(local_tz, now)
+
         for region in self._regions:
             ec2r = self._session.resource('ec2', region_name=region)
             instances = ec2r.instances.filter(Filters=[
@@ -98,98 +96,60 @@ class AWS(wdcloud.WDCloud):
                         if not self._get_tag(instance.tags, tag_key):
                             continue
 
-                i += 1
                 excluded = True if self._get_tag(instance.tags, 'EXCLUDE') else False
                 image_name = ''
                 private_ip_address = instance.private_ip_address or ''
                 public_ip_address = instance.public_ip_address or ''
                 instance_state = instance.state['Name']
                 last_user = self._get_tag(instance.tags, 'Last_user') or ''
-                uptime = ''
+                seconds = None
                 name = self._get_tag(instance.tags, 'Name')
                 if name is None:
                     name = ''
-                then = instance.launch_time.astimezone(local_tz)
-                launch_time = str(then).partition('+')[0]
+                launched = clock.parse(instance.launch_time)
+                launch_time = clock.local(launched)
                 if instance_state == 'running':
-                    seconds = self._date_diff(now, then)
-                    uptime = self._get_uptime(seconds)
-
-                    if seconds >= (critical_threshold * 3600) and not excluded:
-                        if region not in stop_dict:
-                            stop_dict[region] = []
-                        stop_dict[region].append(instance.id)
-
-                    if last_user and notify and not excluded:
-                        name_dict[instance.id] = name
-                        uptime_dict[instance.id] = uptime
-                        if last_user not in info_dict:
-                            info_dict[last_user] = {}
-                        if region not in info_dict[last_user]:
-                            info_dict[last_user][region] = []
-                        info_dict[last_user][region].append(instance.id)
-
-                        if seconds >= (critical_threshold * 3600):
-                            critical_dict[last_user] = True
-                        elif seconds >= (warning_threshold * 3600):
-                            warning_dict[last_user] = True
+                    seconds = clock.seconds(launched)
 
                 try:
                     image_name = instance.image.name[0:15]
                 except AttributeError:
                     pass
-                table.add_row([
-                    instance.placement['AvailabilityZone'],
-                    instance.id,
-                    name,
-                    instance.instance_type,
-                    image_name,
-                    instance_state,
-                    launch_time,
-                    uptime,
-                    last_user,
-                    instance.key_name,
-                    private_ip_address,
-                    public_ip_address,
-                    excluded
-                ])
-                if instance.state['Name'] in states_dict:
-                    states_dict[instance.state['Name']] += 1
-                else:
-                    states_dict[instance.state['Name']] = 1
-        print(table)
-        out = ', '.join(['%s: %s' % (key, value) for (key, value) in sorted(states_dict.items())])
-        if len(out) > 0:
-            out = '(%s)' % out
-        else:
-            out = ''
-        print('Time: %s (%s) | Instances: %s %s' % (now.strftime('%Y-%m-%d %H:%M:%S'), str(local_tz), i, out))
-        if len(info_dict) > 0:
-            print()
-
-        for user, region_ids in info_dict.items():
-            if user in critical_dict:
-                mail_type = 'critical'
-            elif user in warning_dict:
-                mail_type = 'warning'
-            else:
-                mail_type = 'info'
-            self._send_alert(mail_type,
-                             user,
-                             region_ids,
-                             name_dict,
-                             uptime_dict,
-                             warning_threshold,
-                             critical_threshold,
-                             stop)
-
-        if stop and len(stop_dict) > 0:
-            for region, iids in stop_dict.items():
-                print('\nStopping instances in region %s (%s)... %s' % (
-                    region,
-                    ','.join(iids),
-                    'SUCCESS' if self._stop_instance(region, iids) else 'FAIL')
-                      )
+
+                yield wdcloud.Record(
+                    region=region,
+                    iid=instance.id,
+                    name=name,
+                    user=last_user,
+                    state=instance_state,
+                    seconds=seconds,
+                    launch_time=launch_time,
+                    excluded=excluded,
+                    stop_key=region,
+                    row=[
+                        instance.placement['AvailabilityZone'],
+                        instance.id,
+                        name,
+                        instance.instance_type,
+                        image_name,
+                        instance_state,
+                        launch_time,
+                        '',
+                        last_user,
+                        instance.key_name,
+                        private_ip_address,
+                        public_ip_address,
+                        excluded
+                    ]
+                )
+
+    def _stop_resources(self, stop_dict, resource='instance', stream=None):
+        for region, iids in stop_dict.items():
+            print('\nStopping instances in region %s (%s)... %s' % (
+                region,
+                ','.join(iids),
+                'SUCCESS' if self._stop_instance(region, iids) else 'FAIL'),
+                  file=stream)
 
     def _stop_instance(self, region, instance_ids):
         ec2r = self._session.resource('ec2', region_name=region)
@@ -355,49 +315,53 @@ class AWS(wdcloud.WDCloud):
                 else:
                     print('OK')
 
-    def public_buckets(self, disable_border=False, disable_header=False, *args, **kwargs):
-        s3c = self._session.client('s3')
-
+    def public_buckets(self, disable_border=False, disable_header=False, output='table', *args, **kwargs):
         table = prettytable.PrettyTable(['Public S3 bucket', 'ACL'],
                                         border=not disable_border, header=not disable_header, reversesort=False,
                                         sortby='Public S3 bucket')
         table.align = 'l'
 
-        public_acl_indicator = 'http://acs.amazonaws.com/groups/global/AllUsers'
-        public_buckets = {}
+        def fetch():
+            s3c = self._session.client('s3')
+            public_acl_indicator = 'http://acs.amazonaws.com/groups/global/AllUsers'
+            public_buckets = {}
 
-        list_bucket_response = None
-        try:
-            list_bucket_response = s3c.list_buckets()
-        except botocore.exceptions.ClientError as e:
-            print(e)
-            exit(1)
-
-        for bucket_dict in list_bucket_response.get('Buckets'):
-            bucket = bucket_dict.get('Name')
-            bucket_acl_response = None
+            list_bucket_response = None
             try:
-                bucket_acl_response = s3c.get_bucket_acl(Bucket=bucket)
+                list_bucket_response = s3c.list_buckets()
             except botocore.exceptions.ClientError as e:
                 print(e)
                 exit(1)
 
-            for grant in bucket_acl_response.get('Grants'):
-                for (k, v) in grant.items():
-                    if k == 'Permission' and grant.get('Grantee').get('URI') == public_acl_indicator:
-                        if bucket_dict.get('Name') not in public_buckets:
-                            public_buckets[bucket] = [v]
-                        else:
-                            if v not in public_buckets[bucket_dict.get('Name')]:
-                                public_buckets[bucket].append(v)
-
-        if public_buckets:
-            for bucket, acl in public_buckets.items():
-                table.add_row([bucket, ', '.join(acl)])
-
-        print(table)
-        print('[%s] Public buckets: %s/%s' %
-              (self._profile_name, len(public_buckets), len(list_bucket_response.get('Buckets'))))
+            for bucket_dict in list_bucket_response.get('Buckets'):
+                bucket = bucket_dict.get('Name')
+                bucket_acl_response = None
+                try:
+                    bucket_acl_response = s3c.get_bucket_acl(Bucket=bucket)
+                except botocore.exceptions.ClientError as e:
+                    print(e)
+                    exit(1)
+
+                for grant in bucket_acl_response.get('Grants'):
+                    for (k, v) in grant.items():
+                        if k == 'Permission' and grant.get('Grantee').get('URI') == public_acl_indicator:
+                            if bucket_dict.get('Name') not in public_buckets:
+                                public_buckets[bucket] = [v]
+                            else:
+                                if v not in public_buckets[bucket_dict.get('Name')]:
+                                    public_buckets[bucket].append(v)
+
+            return {'public': public_buckets, 'total': len(list_bucket_response.get('Buckets'))}
+
+        buckets = self._read_through('public-buckets', fetch)
+
+        writer = wdoutput.get_writer(output, table)
+        for bucket, acl in buckets['public'].items():
+            writer.add([bucket, ', '.join(acl)])
+        writer.close()
+
+        print('[%s] Public buckets: %s/%s' % (self._profile_name, len(buckets['public']), buckets['total']),
+              file=writer.log_stream)
 
     def _run(self, number, region, subnet_id, image_id, instance_type, ssh_key, private_ip=None, volume_size=10,
              user_data=''):
@@ -7,10 +7,11 @@ Copyright (C) 2019 WANdisco
 """
 
 from __future__ import print_function
-import datetime
+import sys
+import calendar
+import threading
+import time
 import prettytable
-import tzlocal
-import iso8601
 
 from azure.common.credentials import ServicePrincipalCredentials
 from azure.mgmt.resource.subscriptions import SubscriptionClient
@@ -23,12 +24,23 @@ from msrestazure.azure_exceptions import CloudError
 
 from CONFIG import CONFIG
 import logging
-from wdcloud import WDCloud
+from wdcloud import WDCloud, Record
+from wdtime import Clock
+import wdtrace
 
 log = logging.getLogger('cloud_tools')
 
 
 class AZURE(WDCloud):
+    ACTIVITY_LOG_DAYS = 30
+    ACTIVITY_LOG_OVERLAP = 1800
+    OPERATION_TIMEOUT = 3600
+    ACTIVITY_LOG_OPERATIONS = [
+        'Microsoft.Compute/virtualMachines/start/action',
+        'Microsoft.Compute/virtualMachines/write',
+        'Microsoft.HDInsight/clusters/write'
+    ]
+
     def __init__(self, *args, **kwargs):
         super(AZURE, self).__init__(*args, **kwargs)
 
@@ -46,13 +58,16 @@ class AZURE(WDCloud):
         self._network_client = NetworkManagementClient(self._credentials, self._subscription_id)
         self._monitor_client = MonitorClient(self._credentials, self._subscription_id)
         self._hdi_client = HDInsightManagementClient(self._credentials, self._subscription_id)
+        wdtrace.instrument_azure(self._subscription_client, self._compute_client, self._resource_client,
+                                 self._network_client, self._monitor_client, self._hdi_client)
+        self._callers = None
+        self._callers_lock = threading.Lock()
 
-        self._resource_groups = []
-        for resource_group in self._resource_client.resource_groups.list():
-            self._resource_groups.append(resource_group.name)
+        self._resource_groups = None
 
-        for location in self._subscription_client.subscriptions.list_locations(self._subscription_id):
-            self._regions.append(location.name)
+        self._regions.extend(self._read_through('regions', lambda: [
+            location.name for location in self._subscription_client.subscriptions.list_locations(self._subscription_id)
+        ]))
 
     def list_hdi(self, warning_threshold, critical_threshold, disable_border, disable_header, notify, stop,
                  *args, **kwargs):
@@ -60,278 +75,150 @@ class AZURE(WDCloud):
                                          'Cluster State', 'Excluded'], sortby='Created Date',
                                         border=not disable_border, header=not disable_header, reversesort=True)
         table.align = 'l'
-        local_tz = tzlocal.get_localzone()
-        now = local_tz.localize(datetime.datetime.now())
+        local_tz, now = self._clock()
+        self._report(self._clusters(local_tz, now), table, local_tz, now, warning_threshold, critical_threshold,
+                     notify=notify, stop=stop, resource='HDI cluster', label='Clusters', **kwargs)
+
+    def _clusters(self, local_tz, now):
         clusters = self._hdi_client.clusters.list()
-        states_dict = {}
-        stop_dict = {}
-        dept_dict = {}
-        rg_dict = {}
-        name_dict = {}
-        uptime_dict = {}
-        info_dict = {}
-        warning_dict = {}
-        critical_dict = {}
-        i = 0
-        while True:
-            try:
-                for cluster in clusters.advance_page():
-                    i += 1
-                    rg = cluster.id
-                    _, _, rg = rg.partition('/resourceGroups/')
-                    rg, _, _ = rg.partition('/providers/')
-                    created_date = iso8601.parse_date(cluster.properties.created_date).astimezone(local_tz).\
-                        strftime('%Y-%m-%d %H:%M:%S')
-                    launch_time_src = iso8601.parse_date(cluster.properties.created_date).astimezone(local_tz)
-                    seconds = self._date_diff(now, launch_time_src)
-                    uptime = self._get_uptime(seconds)
-
-                    start = datetime.datetime.now().date() - datetime.timedelta(days=30)
-                    afilter = " and ".join([
-                        "eventTimestamp ge '%s'" % start,
-                        "eventChannels eq 'Admin, Operation'",
-                        "resourceUri eq '%s'" % cluster.id
-                    ])
-                    select = ",".join([
-                        "caller",
-                        "eventName",
-                        "operationName",
-                        "eventTimestamp"
-                    ])
-                    activity_logs = self._monitor_client.activity_logs.list(
-                        filter=afilter,
-                        select=select
-                    )
-
-                    creator = ''
-                    for alog in activity_logs:
-                        if alog.caller and ("Microsoft.HDInsight/clusters/write" in alog.operation_name.value):
-                            creator = alog.caller.split('@', 1)[0]
-                            break
-
-                    if cluster.tags:
-                        excluded = True if 'exclude' in [t.lower() for t in cluster.tags] else False
-                    else:
-                        excluded = False
-
-                    table.add_row([cluster.location, cluster.name, rg, creator, created_date, uptime,
-                                   cluster.properties.cluster_state, 'Yes' if excluded else 'No'])
-
-                    if cluster.properties.cluster_state in states_dict:
-                        states_dict[cluster.properties.cluster_state] += 1
-                    else:
-                        states_dict[cluster.properties.cluster_state] = 1
-
-                    if seconds >= (critical_threshold * 3600) and not excluded and\
-                            'sales' not in str(rg).lower() and cluster.properties.cluster_state != 'Deleting':
-                        if rg not in stop_dict:
-                            stop_dict[rg] = []
-                        stop_dict[rg].append(cluster.name)
-
-                    if creator and notify and not excluded and cluster.properties.cluster_state != 'Deleting':
-                        if creator not in dept_dict:
-                            dept_dict[creator] = []
-                        if rg.partition('-')[0] not in dept_dict[creator]:
-                            dept_dict[creator].append(rg.partition('-')[0])
-                        rg_dict[cluster.name] = rg
-                        name_dict[cluster.name] = cluster.name
-                        uptime_dict[cluster.name] = uptime
-                        if creator not in info_dict:
-                            info_dict[creator] = {}
-                        if cluster.location not in info_dict[creator]:
-                            info_dict[creator][cluster.location] = []
-                        info_dict[creator][cluster.location].append(cluster.name)
-
-                        if seconds >= (critical_threshold * 3600):
-                            critical_dict[creator] = True
-                        elif seconds >= (warning_threshold * 3600):
-                            warning_dict[creator] = True
-            except StopIteration:
-                break
-
-        log.debug('info_dict: %s' % info_dict)
-        log.debug('warning_dict: %s' % warning_dict)
-        log.debug('critical_dict: %s' % critical_dict)
-        log.info(table)
-        out = ', '.join(['%s: %s' % (key, value) for (key, value) in sorted(states_dict.items())])
-        if len(out) > 0:
-            out = '(%s)' % out
-        else:
-            out = ''
-        print('Time: %s (%s) | Clusters: %s %s' % (now.strftime('%Y-%m-%d %H:%M:%S'), str(local_tz), i, out))
-
-        for user, region_ids in info_dict.items():
-            if user in critical_dict:
-                mail_type = 'critical'
-            elif user in warning_dict:
-                mail_type = 'warning'
+        clock = Clock(local_tz, now)
+
+        def pages():
+            while True:
+                try:
+                    page = clusters.advance_page()
+                except StopIteration:
+                    break
+                for item in page:
+                    yield item
+
+        def enrich(cluster):
+            rg = self._resource_group(cluster.id)
+            created = clock.parse(cluster.properties.created_date)
+            created_date = clock.local(created)
+            seconds = clock.seconds(created)
+            creator = self._activity_callers().get(cluster.id.lower(), '')
+            cluster_state = cluster.properties.cluster_state
+
+            if cluster.tags:
+                excluded = True if 'exclude' in [t.lower() for t in cluster.tags] else False
             else:
-                mail_type = 'info'
-            self._send_alert(
-                mail_type=mail_type,
-                user=user,
-                region_ids=region_ids,
-                name_dict=name_dict,
-                uptime_dict=uptime_dict,
-                warning_threshold=warning_threshold,
-                critical_threshold=critical_threshold,
-                stop=stop,
-                dept=dept_dict[user],
-                rg_dict=rg_dict,
-                resource='HDI cluster'
+                excluded = False
+
+            return Record(
+                region=cluster.location,
+                iid=cluster.name,
+                name=cluster.name,
+                user=creator,
+                state=cluster_state,
+                seconds=seconds,
+                launch_time=created_date,
+                active=cluster_state != 'Deleting',
+                excluded=excluded,
+                stop_key=rg if 'sales' not in str(rg).lower() else None,
+                dept=rg.partition('-')[0],
+                rg=rg,
+                row=[cluster.location, cluster.name, rg, creator, created_date, '', cluster_state,
+                     'Yes' if excluded else 'No']
             )
 
-        if stop and len(stop_dict) > 0:
-            for rg, vms in stop_dict.items():
-                print('\nTerminating HDI clusters in Resource Group %s (%s)... %s' % (
-                    rg,
-                    ','.join(vms),
-                    'SUCCESS' if self._delete_cluster(rg, vms) else 'FAIL'))
+        return self._pipeline(pages(), enrich)
 
     def list(self, disable_border=False, disable_header=False, state=None, notify=False, stop=False,
              warning_threshold=None, critical_threshold=None, tag=None, *args, **kwargs):
-        if not state:
-            state = ['running', 'stopped', 'starting', 'stopping', 'busy', 'generalized']
         table = prettytable.PrettyTable(['Region', 'RG', 'Name', 'Type', 'Image', 'State',
                                          'Launch time', 'Uptime', 'User', 'Private IP', 'Public IP',
                                          'Excluded'],
                                         border=not disable_border, header=not disable_header, reversesort=True,
                                         sortby='Launch time')
         table.align = 'l'
-        i = 0
-        states_dict = {}
-        uptime_dict = {}
-        name_dict = {}
-        stop_dict = {}
-        info_dict = {}
-        warning_dict = {}
-        critical_dict = {}
-        dept_dict = {}
-        rg_dict = {}
-        local_tz = tzlocal.get_localzone()
-        now = local_tz.localize(datetime.datetime.now())
-
-        for resource_group in self._resource_groups:
-
-            instances = self._compute_client.virtual_machines.list(resource_group)
-
-            for instance in instances:
-                region = instance.location
-                if region not in self._regions:
-                    continue
+        local_tz, now = self._clock()
+        self._report(self._cached_instances(local_tz, now, state), table, local_tz, now, warning_threshold,
+                     critical_threshold, notify=notify, stop=stop, snapshot=not state, **kwargs)
 
-                last_user = ''
-                start = datetime.datetime.now().date() - datetime.timedelta(days=30)
-                afilter = " and ".join([
-                    "eventTimestamp ge '%s'" % start,
-                    "eventChannels eq 'Admin, Operation'",
-                    "resourceUri eq '%s'" % instance.id
-                ])
-                select = ",".join([
-                    "caller",
-                    "eventName",
-                    "operationName",
-                    "eventTimestamp"
-                ])
-                activity_logs = self._monitor_client.activity_logs.list(
-                    filter=afilter,
-                    select=select
-                )
-
-                for alog in activity_logs:
-                    if alog.caller and ("virtualMachines/start/action" in alog.operation_name.value or
-                                        "virtualMachines/write" in alog.operation_name.value):
-                        last_user = alog.caller.split('@', 1)[0]
-                        break
-
-                instance_data = self._compute_client.virtual_machines.get(resource_group, instance.name,
-                                                                          expand='instanceView')
-                try:
-                    instance_state = str(instance_data.instance_view.statuses[1].display_status).split('VM ')[1]
-                except IndexError:
-                    instance_state = 'busy'
-
-                if instance_state == 'deallocated':
-                    instance_state = 'stopped'
-                elif instance_state == 'deallocating':
-                    instance_state = 'stopping'
-
-                if instance_state not in state:
-                    if len(state) > 1:
-                        print('UNKNOWN INSTANCE STATE: %s\n' % instance_state)
-                    continue
+    def _instances(self, local_tz, now, state=None, *args, **kwargs):
+        if not state:
+            state = ['running', 'stopped', 'starting', 'stopping', 'busy', 'generalized']
+        net_interfaces = self._index(self._network_client.network_interfaces.list_all())
+        public_ips = self._index(self._network_client.public_ip_addresses.list_all())
+        callers = self._activity_callers()
+        clock = Clock(local_tz, now)
+
+        for instance in self._list_vms(instance_view=True):
+            region = instance.location
+            if region not in self._regions:
+                continue
+            resource_group = self._resource_group(instance.id)
+            last_user = callers.get(instance.id.lower(), '')
+
+            instance_view = instance.instance_view
+            try:
+                instance_state = str(instance_view.statuses[1].display_status).split('VM ')[1]
+            except (AttributeError, IndexError, TypeError):
+                instance_state = 'busy'
 
-                instance_type = instance_data.hardware_profile.vm_size
+            if instance_state == 'deallocated':
+                instance_state = 'stopped'
+            elif instance_state == 'deallocating':
+                instance_state = 'stopping'
 
-                try:
-                    image_name = instance_data.storage_profile.image_reference.offer + ' ' + \
-                        instance_data.storage_profile.image_reference.sku
-                except (AttributeError, TypeError):
-                    image_name = ''
+            if instance_state not in state:
+                if len(state) > 1:
+                    print('UNKNOWN INSTANCE STATE: %s' % instance_state, file=sys.stderr)
+                continue
 
-                nic_group = instance_data.network_profile.network_interfaces[0].id.split('/')[4]
-                nic_name = instance_data.network_profile.network_interfaces[0].id.split('/')[8]
+            instance_type = instance.hardware_profile.vm_size
 
-                try:
-                    net_interface = self._network_client.network_interfaces.get(nic_group, nic_name)
-                    private_ip_address = net_interface.ip_configurations[0].private_ip_address
-                except CloudError:
-                    private_ip_address = ''
+            try:
+                image_name = instance.storage_profile.image_reference.offer + ' ' + \
+                    instance.storage_profile.image_reference.sku
+            except (AttributeError, TypeError):
+                image_name = ''
+
+            private_ip_address = ''
+            public_ip_address = ''
+            try:
+                net_interface = net_interfaces.get(instance.network_profile.network_interfaces[0].id.lower())
+                ip_configuration = net_interface.ip_configurations[0]
+            except (AttributeError, IndexError, TypeError):
+                pass
+            else:
+                private_ip_address = ip_configuration.private_ip_address or ''
+                if ip_configuration.public_ip_address:
+                    public_ip = public_ips.get(ip_configuration.public_ip_address.id.lower())
+                    public_ip_address = (public_ip.ip_address if public_ip else None) or ''
 
-                net_interface = None
+            seconds = None
+            launch_time = ''
+
+            if instance.tags:
+                excluded = True if 'exclude' in [t.lower() for t in instance.tags] else False
+            else:
+                excluded = False
+
+            if instance_state == 'running':
                 try:
-                    ip_group = net_interface.ip_configurations[0].public_ip_address.id.split('/')[4]
-                    ip_name = net_interface.ip_configurations[0].public_ip_address.id.split('/')[8]
-                    public_ip_address = self._network_client.public_ip_addresses.get(ip_group, ip_name).ip_address or ''
+                    launched = clock.parse(instance_view.disks[0].statuses[0].time if instance_view.disks else
+                                           instance_view.statuses[0].time)
                 except AttributeError:
-                    public_ip_address = ''
-
-                uptime = ''
-                launch_time = ''
-
-                if instance.tags:
-                    excluded = True if 'exclude' in [t.lower() for t in instance.tags] else False
-                else:
-                    excluded = False
-
-                if instance_state == 'running':
-                    try:
-                        launch_time_src = instance_data.instance_view.disks[0].statuses[0].time.astimezone(local_tz)
-                        launch_time = launch_time_src.strftime('%Y-%m-%d %H:%M:%S')
-                    except AttributeError:
-                        launch_time_src = ''
-                        launch_time = ''
-
-                    seconds = self._date_diff(now, launch_time_src)
-                    uptime = self._get_uptime(seconds)
-
-                    if seconds >= (critical_threshold * 3600) and not excluded and\
-                            'sales' not in str(resource_group).lower():
-                        if resource_group not in stop_dict:
-                            stop_dict[resource_group] = []
-                        stop_dict[resource_group].append(instance.name)
-
-                    if last_user and notify and not excluded:
-                        if last_user not in dept_dict:
-                            dept_dict[last_user] = []
-                        if resource_group not in dept_dict[last_user]:
-                            dept_dict[last_user].append(resource_group)
-                        rg_dict[instance.name] = resource_group
-                        name_dict[instance.name] = instance.name
-                        uptime_dict[instance.name] = uptime
-                        if last_user not in info_dict:
-                            info_dict[last_user] = {}
-                        if region not in info_dict[last_user]:
-                            info_dict[last_user][region] = []
-                        info_dict[last_user][region].append(instance.name)
-
-                        if seconds >= (critical_threshold * 3600):
-                            critical_dict[last_user] = True
-                        elif seconds >= (warning_threshold * 3600):
-                            warning_dict[last_user] = True
-
-                i += 1
-                table.add_row([
+                    launched = None
+                if launched is not None:
+                    launch_time = clock.local(launched)
+                    seconds = clock.seconds(launched)
+
+            yield Record(
+                region=region,
+                iid=instance.name,
+                name=instance.name,
+                user=last_user,
+                state=instance_state,
+                seconds=seconds,
+                launch_time=launch_time,
+                excluded=excluded,
+                stop_key=resource_group if 'sales' not in str(resource_group).lower() else None,
+                dept=resource_group,
+                rg=resource_group,
+                row=[
                     instance.location,
                     resource_group,
                     instance.name,
@@ -339,124 +226,225 @@ class AZURE(WDCloud):
                     image_name,
                     instance_state,
                     launch_time,
-                    uptime,
+                    '',
                     last_user,
                     private_ip_address,
                     public_ip_address,
                     'Yes' if excluded else 'No'
-                ])
-                if instance_state in states_dict:
-                    states_dict[instance_state] += 1
-                else:
-                    states_dict[instance_state] = 1
-        print(table)
-        out = ', '.join(['%s: %s' % (key, value) for (key, value) in sorted(states_dict.items())])
-        if len(out) > 0:
-            out = '(%s)' % out
-        else:
-            out = ''
-        print('Time: %s (%s) | Instances: %s %s' % (now.strftime('%Y-%m-%d %H:%M:%S'), str(local_tz), i, out))
-        if len(info_dict) > 0:
-            print()
-
-        for user, region_ids in info_dict.items():
-            if user in critical_dict:
-                mail_type = 'critical'
-            elif user in warning_dict:
-                mail_type = 'warning'
-            else:
-                mail_type = 'info'
-            self._send_alert(
-                mail_type=mail_type,
-                user=user,
-                region_ids=region_ids,
-                name_dict=name_dict,
-                uptime_dict=uptime_dict,
-                warning_threshold=warning_threshold,
-                critical_threshold=critical_threshold,
-                stop=stop,
-                dept=dept_dict[user],
-                rg_dict=rg_dict
+                ]
             )
 
-        if stop and len(stop_dict) > 0:
-            for rg, vms in stop_dict.items():
-                print('\nStopping instances in Resource Group %s (%s)... %s' % (
-                    rg,
-                    ','.join(vms),
-                    'SUCCESS' if self._stop_instance(rg, vms) else 'FAIL'))
-
-    def _create_tag(self, resource_group, instance, key, value):
-        try:
-            self._compute_client.virtual_machines.create_or_update(resource_group, instance.name, {
-                'location': instance.location,
-                'tags': {key: value}
-            }).wait()
-        except CloudError:
-            return False
+    def _stop_resources(self, stop_dict, resource='instance', stream=None):
+        if resource == 'HDI cluster':
+            print('\nTerminating HDI clusters...', file=stream)
+            for (rg, cluster), status in sorted(self._delete_clusters(stop_dict).items()):
+                print('Resource Group %s, HDI cluster %s... %s' % (rg, cluster, status), file=stream)
         else:
-            return True
-
-    def _delete_tag(self, resource_group, instance, key):
+            print('\nStopping instances...', file=stream)
+            for (rg, vm), status in sorted(self._stop_instances(stop_dict).items()):
+                print('Resource Group %s, instance %s... %s' % (rg, vm, status), file=stream)
+
+    def _activity_callers(self):
+        with self._callers_lock:
+            if self._callers is None:
+                self._callers = self._fetch_activity_callers()
+        return self._callers
+
+    def _fetch_activity_callers(self):
+        cache_name = 'azure-activity-%s' % self._subscription_id
+        cache = self._load_cache(cache_name) or {}
+        window_start = int(time.time()) - self.ACTIVITY_LOG_DAYS * 86400
+        last_timestamp = max(cache.get('timestamp', 0), window_start)
+        query_start = max(last_timestamp - self.ACTIVITY_LOG_OVERLAP, window_start)
+        callers = cache.get('callers', {})
+        events = cache.get('events', {})
+
+        afilter = " and ".join([
+            "eventTimestamp ge '%s'" % time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(query_start)),
+            "eventChannels eq 'Admin, Operation'"
+        ])
+        select = ",".join([
+            "eventDataId",
+            "caller",
+            "operationName",
+            "eventTimestamp",
+            "resourceId"
+        ])
+        operations = [operation.lower() for operation in self.ACTIVITY_LOG_OPERATIONS]
+        log.debug('Fetching activity logs: %s' % afilter)
+        for alog in self._monitor_client.activity_logs.list(filter=afilter, select=select):
+            if not alog.caller or not alog.resource_id or not alog.operation_name:
+                continue
+            if str(alog.operation_name.value).lower() not in operations:
+                continue
+            timestamp = calendar.timegm(alog.event_timestamp.utctimetuple())
+            if alog.event_data_id:
+                if alog.event_data_id in events:
+                    continue
+                events[alog.event_data_id] = timestamp
+            resource_id = alog.resource_id.lower()
+            if resource_id not in callers or callers[resource_id][0] < timestamp:
+                callers[resource_id] = [timestamp, alog.caller.split('@', 1)[0]]
+            last_timestamp = max(last_timestamp, timestamp)
+
+        callers = dict((rid, value) for (rid, value) in callers.items() if value[0] >= window_start)
+        events = dict((eid, timestamp) for (eid, timestamp) in events.items()
+                      if timestamp >= last_timestamp - self.ACTIVITY_LOG_OVERLAP)
+        self._save_cache(cache_name, {'timestamp': last_timestamp, 'callers': callers, 'events': events})
+
+        return dict((rid, value[1]) for (rid, value) in callers.items())
+
+    def _get_resource_groups(self):
+        if self._resource_groups is None:
+            self._resource_groups = []
+            for resource_group in self._resource_client.resource_groups.list():
+                self._resource_groups.append(resource_group.name)
+        return self._resource_groups
+
+    def _list_vms(self, instance_view=False):
+        try:
+            instances = list(self._compute_client.virtual_machines.list_all())
+            if instance_view:
+                instance_views = self._index(self._compute_client.virtual_machines.list_all(status_only='true'))
+                missing = []
+                for instance in instances:
+                    instance.instance_view = getattr(instance_views.get(instance.id.lower()), 'instance_view', None)
+                    if instance.instance_view is None:
+                        missing.append(instance)
+                if missing:
+                    log.debug('No instance view for %s VM(s) in subscription listing, fetching per VM' %
+                              len(missing))
+                    self._map(self._fetch_instance_view, missing)
+            return instances
+        except CloudError as e:
+            log.debug('Unable to list VMs in subscription, listing per Resource Group (%s)' % e)
+        return self._list_vms_by_resource_group(instance_view)
+
+    def _fetch_instance_view(self, instance):
         try:
-            self._compute_client.virtual_machines.create_or_update(resource_group, instance.name, {
-                'location': instance.location,
-                'tags': {key: ''}
-            }).wait()
-        except CloudError:
-            return False
+            instance.instance_view = self._compute_client.virtual_machines.instance_view(
+                self._resource_group(instance.id), instance.name)
+        except CloudError as e:
+            log.debug(e)
+
+    def _list_vms_by_resource_group(self, instance_view=False):
+        cache_name = 'azure-rg-vms-%s' % self._subscription_id
+        cache = self._load_cache(cache_name) or {}
+        expired = self._refresh or time.time() - cache.get('timestamp', 0) >= self._cache_ttl
+        counts = {} if expired else cache.get('counts', {})
+
+        def list_rg(resource_group):
+            try:
+                rg_instances = list(self._compute_client.virtual_machines.list(resource_group))
+                if instance_view:
+                    for instance in rg_instances:
+                        instance.instance_view = self._compute_client.virtual_machines.instance_view(
+                            resource_group, instance.name)
+            except CloudError as e:
+                log.debug(e)
+                return resource_group, None
+            return resource_group, rg_instances
+
+        instances = []
+        resource_groups = [rg for rg in self._get_resource_groups() if counts.get(rg) != 0]
+        for resource_group, rg_instances in self._map(list_rg, resource_groups):
+            if rg_instances is None:
+                continue
+            counts[resource_group] = len(rg_instances)
+            instances += rg_instances
+
+        if expired:
+            self._save_cache(cache_name, {'timestamp': int(time.time()), 'counts': counts})
+        return instances
+
+    @staticmethod
+    def _index(resources):
+        index = {}
+        for resource in resources:
+            index[resource.id.lower()] = resource
+        return index
+
+    @staticmethod
+    def _resource_group(resource_id):
+        _, _, rg = str(resource_id).partition('/resourceGroups/')
+        rg, _, _ = rg.partition('/')
+        return rg
+
+    def _vm_index(self, refresh=False):
+        cache_name = 'azure-vms-%s' % self._subscription_id
+        index = None if refresh else self._load_cache(cache_name)
+        if index is None:
+            index = {}
+            for instance in self._list_vms():
+                index.setdefault(instance.name, []).append(instance.id)
+            self._save_cache(cache_name, index)
+        return index
+
+    def _update_tag(self, resource_group, name, key, value='', delete=False):
+        instance = self._compute_client.virtual_machines.get(resource_group, name)
+        tags = dict(instance.tags or {})
+        if delete:
+            tags.pop(key, None)
         else:
-            return True
+            tags[key] = value
+        return self._compute_client.virtual_machines.update(resource_group, name, {'tags': tags})
 
     def tag(self, instance_id, key, value='', delete=False, *args, **kwargs):
-        i = 0
-        resource_group = self._profile_name.upper()
-        instances = self._compute_client.virtual_machines.list(resource_group)
-
-        for instance in instances:
-            if instance.name in instance_id:
-                i += 1
-                if delete:
-                    print('Instance ID %s found in region %s, deleting tag \'%s\': ' %
-                          (instance.name, instance.location, key), end='')
-                    response = self._delete_tag(resource_group, instance, key)
-                else:
-                    print('Instance ID %s found in region %s, creating tag \'%s\': ' %
-                          (instance.name, instance.location, key), end='')
-                    response = self._create_tag(resource_group, instance, key, value)
-                if response:
-                    print('OK')
-                else:
-                    print('FAIL')
-                if len(instance_id) == i:
-                    return
-
-        if i == 0:
+        index = self._vm_index()
+        if [name for name in instance_id if name not in index]:
+            index = self._vm_index(refresh=True)
+
+        resources = {}
+        for name in instance_id:
+            for resource_id in index.get(name, []):
+                resources.setdefault(self._resource_group(resource_id), []).append(name)
+
+        if not resources:
             print('Instance ID %s not found in any region' % (', '.join(instance_id)))
+            return
 
-    def _stop_instance(self, rg, vms):
-        error = False
+        pollers = self._start_operations(
+            lambda rg, name: self._update_tag(rg, name, key, value=value, delete=delete),
+            resources
+        )
+        for (rg, name), status in sorted(self._wait_for_operations(pollers).items()):
+            print('Instance ID %s found in Resource Group %s, %s tag \'%s\': %s' %
+                  (name, rg, 'deleting' if delete else 'creating', key, 'OK' if status == 'SUCCESS' else status))
 
-        for vm in vms:
+    def _start_operations(self, operation, resources):
+        def start(key):
             try:
-                self._compute_client.virtual_machines.deallocate(rg, vm).wait()
+                return operation(*key)
             except Exception as e:
                 log.debug(e)
-                error = True
-
-        return False if error else True
-
-    def _delete_cluster(self, rg, clusters):
-        error = False
-
-        for cluster in clusters:
+                return None
+
+        keys = [(rg, name) for rg, names in resources.items() for name in names]
+        return dict(zip(keys, self._map(start, keys)))
+
+    def _wait_for_operations(self, pollers, timeout=None):
+        end = time.time() + (timeout or self.OPERATION_TIMEOUT)
+        results = {}
+        for key, poller in pollers.items():
+            if poller is None:
+                results[key] = 'FAIL'
+                continue
             try:
-                self._hdi_client.clusters.delete(rg, cluster)
+                poller.wait(timeout=max(end - time.time(), 0))
             except Exception as e:
                 log.debug(e)
-                error = True
-
-        return False if error else True
+                results[key] = 'FAIL'
+                continue
+            results[key] = 'SUCCESS' if poller.done() else 'TIMEOUT'
+        return results
+
+    def _stop_instances(self, vms, timeout=None):
+        pollers = self._start_operations(self._compute_client.virtual_machines.deallocate, vms)
+        return self._wait_for_operations(pollers, timeout)
+
+    def _delete_clusters(self, clusters, timeout=None):
+        pollers = self._start_operations(self._hdi_client.clusters.delete, clusters)
+        return self._wait_for_operations(pollers, timeout)
 
     def sg(self, *args, **kwargs):
         log.critical('Command not implemented')
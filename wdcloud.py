@@ -9,32 +9,202 @@ Copyright (C) 2019 WANdisco
 from __future__ import print_function
 import os
 import abc
+import time
+import datetime
+import hashlib
+import json
+import threading
+import contextlib
 import prettytable
+import tzlocal
+from multiprocessing.pool import ThreadPool
 from string import Template
 from ppmail import Mailer
 from CONFIG import CONFIG
+from wdnotify import Dispatcher, NotificationStore
+from wdoutput import get_writer
+from wdsnapshot import SnapshotStore, Snapshots
+from wduptime import Classifier, get_uptime
 import logging
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 log = logging.getLogger('cloud_tools')
 
 
+def map_concurrently(func, items, workers):
+    items = list(items)
+    if not items:
+        return []
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class Record(object):
+    __slots__ = ['region', 'iid', 'name', 'user', 'state', 'seconds', 'uptime', 'launch_time', 'active', 'excluded',
+                 'stop_key', 'dept', 'rg', 'row']
+
+    def __init__(self, region, iid, name, user, state, seconds=None, uptime='', launch_time='', active=None,
+                 excluded=False, stop_key=None, dept=None, rg=None, row=None):
+        self.region = region
+        self.iid = iid
+        self.name = name
+        self.user = user
+        self.state = state
+        self.seconds = seconds
+        self.uptime = uptime
+        self.launch_time = launch_time
+        self.active = seconds is not None if active is None else active
+        self.excluded = excluded
+        self.stop_key = stop_key
+        self.dept = dept
+        self.rg = rg
+        self.row = row
+
+
+class CacheWriter(object):
+    """Response cache file written item by item and published only once the whole response was written."""
+
+    def __init__(self, path, saved_at):
+        self._path = path
+        self._count = 0
+        try:
+            self._file = open(path + '.tmp', 'w')
+            self._file.write('{"saved_at": %s, "data": [' % json.dumps(saved_at))
+        except (IOError, OSError) as e:
+            log.debug('Unable to save cache %s (%s)' % (path, e))
+            self._file = None
+
+    def add(self, item):
+        if self._file is None:
+            return
+        try:
+            self._file.write((', ' if self._count else '') + json.dumps(item, default=str))
+            self._count += 1
+        except (IOError, OSError) as e:
+            log.debug('Unable to save cache %s (%s)' % (self._path, e))
+            self.close(False)
+
+    def close(self, complete=True):
+        if self._file is None:
+            return
+        f, self._file = self._file, None
+        try:
+            if complete:
+                f.write(']}')
+            f.close()
+            if complete:
+                os.rename(self._path + '.tmp', self._path)
+            else:
+                os.remove(self._path + '.tmp')
+        except (IOError, OSError) as e:
+            log.debug('Unable to save cache %s (%s)' % (self._path, e))
+
+
+class Inventory(object):
+    SEVERITY = ['info', 'warning', 'critical']
+
+    def __init__(self, warning_threshold, critical_threshold, notify=False):
+        self._classifier = Classifier(warning_threshold, critical_threshold)
+        self._notify = notify
+        self._severity = {}
+        self.count = 0
+        self.states = {}
+        self.names = {}
+        self.uptimes = {}
+        self.rgs = {}
+        self.depts = {}
+        self.regions = {}
+        self.stop = {}
+
+    def classify(self, records):
+        """Format uptimes of a batch of records and return their severities, classified in one pass."""
+        uptimes, severities = self._classifier.classify([record.seconds for record in records])
+        for record, uptime in zip(records, uptimes):
+            record.uptime = uptime
+        return severities
+
+    def add(self, record, severity=None):
+        self.count += 1
+        self.states[record.state] = self.states.get(record.state, 0) + 1
+
+        if not record.active or record.excluded:
+            return
+
+        if severity is None:
+            severity = self._classifier.severity(record.seconds)
+        if record.stop_key is not None and severity == 2:
+            self.stop.setdefault(record.stop_key, []).append(record.iid)
+
+        if record.user and self._notify:
+            user = record.user
+            self.names[record.iid] = record.name
+            self.uptimes[record.iid] = record.uptime
+            if record.rg is not None:
+                self.rgs[record.iid] = record.rg
+            if record.dept is not None:
+                depts = self.depts.setdefault(user, [])
+                if record.dept not in depts:
+                    depts.append(record.dept)
+            self.regions.setdefault(user, {}).setdefault(record.region, []).append(record.iid)
+            self._severity[user] = max(self._severity.get(user, 0), severity)
+
+    def alerts(self):
+        for user, region_ids in self.regions.items():
+            yield user, self.SEVERITY[self._severity.get(user, 0)], region_ids, self.depts.get(user)
+
+
 class WDCloud(object):
     VERSION = '1.2.2'
+    PROVIDERS = ['aws', 'gcp', 'azure']
+    CLOUD_NAMES = {
+        'aws': 'AWS',
+        'gcp': 'GCP',
+        'azure': 'Azure'
+    }
+    CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cloud_tools')
+    MAX_WORKERS = 16
+    SUPPRESS_HOURS = {
+        'info': 24,
+        'warning': 12,
+        'critical': 4
+    }
+    SNAPSHOT_DAYS = 90
+    CACHE_TTL = 300
+    CLASSIFY_BATCH = 1000
+    TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'templates')
     __metaclass__ = abc.ABCMeta
+    _templates = {}
+    _replayed = False
 
-    def __init__(self, cloud_provider, profile_name):
-
-        cloud_names = {
-            'aws': 'AWS',
-            'gcp': 'GCP',
-            'azure': 'Azure'
-        }
-
-        self._cloud_name = cloud_names[cloud_provider]
+    def __init__(self, cloud_provider, profile_name, refresh=False, cached=False):
+        providers = self.PROVIDERS if cloud_provider == 'all' else cloud_provider.split(',')
+        self._cloud_name = self._get_cloud_name(cloud_provider)
         self._profile_name = profile_name
+        self._snapshots = self._snapshot_store()
         self._regions = []
+        self._alert_contexts = {}
+        self._refresh = refresh
+        self._cached = cached
+        self._cache_ttl = getattr(CONFIG, 'CACHE_TTL', self.CACHE_TTL)
         try:
-            self._mailer = Mailer(slack=True)
+            self._dispatcher = Dispatcher(
+                mailer=Mailer(slack=True),
+                store=NotificationStore(os.path.join(self.CACHE_DIR, 'notifications.db'),
+                                        getattr(CONFIG, 'SUPPRESS_HOURS', self.SUPPRESS_HOURS))
+            )
         except Exception as e:
             log.critical(e)
             exit(1)
@@ -44,11 +214,28 @@ class WDCloud(object):
             'GCP': 'https://workspace.wandisco.com/display/IT/GCP+Best+Practices+at+WANdisco',
             'Azure': 'https://workspace.wandisco.com/display/IT/Azure+Best+Practices+at+WANdisco'
         }
+        if self._cloud_name not in self._bp_url:
+            self._bp_url[self._cloud_name] = ', '.join([self._bp_url[self.CLOUD_NAMES[p]] for p in providers])
 
     @staticmethod
-    def loader(cloud_provider, profile_name):
-        module = __import__('wd' + cloud_provider)
-        return getattr(module, cloud_provider.upper())(cloud_provider, profile_name)
+    def loader(cloud_provider, profile_name, refresh=False, cached=False):
+        module_name = 'all' if ',' in cloud_provider else cloud_provider
+        module = __import__('wd' + module_name)
+        return getattr(module, module_name.upper())(cloud_provider, profile_name, refresh=refresh, cached=cached)
+
+    @classmethod
+    def snapshots(cls, cloud_provider, profile_name):
+        return Snapshots(cls._snapshot_store(), cls._get_cloud_name(cloud_provider), profile_name)
+
+    @classmethod
+    def _get_cloud_name(cls, cloud_provider):
+        providers = cls.PROVIDERS if cloud_provider == 'all' else cloud_provider.split(',')
+        return '/'.join([cls.CLOUD_NAMES[provider] for provider in providers])
+
+    @classmethod
+    def _snapshot_store(cls):
+        return SnapshotStore(os.path.join(cls.CACHE_DIR, 'snapshots.db'),
+                             getattr(CONFIG, 'SNAPSHOT_DAYS', cls.SNAPSHOT_DAYS))
 
     @abc.abstractmethod
     def list(self, *args, **kwargs):
@@ -58,78 +245,179 @@ class WDCloud(object):
     def tag(self, *args, **kwargs):
         pass
 
+    def watch(self, interval, warning_threshold, critical_threshold, notify=False, stop=False, bind='127.0.0.1',
+              port=None, *args, **kwargs):
+        from wdwatch import Watcher
+        watcher = Watcher(self, interval, warning_threshold, critical_threshold, notify=notify, stop=stop)
+        watcher.run(bind, port, **kwargs)
+
     def exclude(self, instance_id, *args, **kwargs):
         self.tag(instance_id=instance_id, key='EXCLUDE', value='True', *args, **kwargs)
 
     def include(self, instance_id, *args, **kwargs):
         self.tag(instance_id=instance_id, key='EXCLUDE', value='False', *args, **kwargs)
 
-    def list_regions(self, disable_border, disable_header, *args, **kwargs):
+    @staticmethod
+    def _clock():
+        local_tz = tzlocal.get_localzone()
+        return local_tz, datetime.datetime.now(local_tz)
+
+    def _report(self, records, table, local_tz, now, warning_threshold, critical_threshold, notify=False,
+                stop=False, resource='instance', label='Instances', output='table', snapshot=True, *args, **kwargs):
+        inventory = Inventory(warning_threshold, critical_threshold, notify)
+        writer = get_writer(output, table)
+        uptime_column = table.field_names.index('Uptime') if 'Uptime' in table.field_names else None
+        run = None
+        if snapshot and not self._cached:
+            run = self._snapshot(self._snapshots.start, self._cloud_name, self._profile_name, resource) or None
+        try:
+            for batch in self._batches(records, 1 if writer.streaming else self.CLASSIFY_BATCH):
+                for record, severity in zip(batch, inventory.classify(batch)):
+                    inventory.add(record, severity)
+                    if uptime_column is not None:
+                        record.row[uptime_column] = record.uptime
+                    writer.add(record.row)
+                    if run is not None and self._snapshot(run.add, record, run=run) is False:
+                        run = None
+        except BaseException:
+            if run is not None:
+                run.close(False)
+            raise
+        writer.close()
+        if run is not None:
+            if self._replayed:
+                run.close(False)
+            else:
+                self._snapshot(run.close, run=run)
+
+        stream = writer.log_stream
+        out = ', '.join(['%s: %s' % (key, value) for (key, value) in sorted(inventory.states.items())])
+        if len(out) > 0:
+            out = '(%s)' % out
+        else:
+            out = ''
+        print('Time: %s (%s) | %s: %s %s' % (now.strftime('%Y-%m-%d %H:%M:%S'), str(local_tz), label,
+                                             inventory.count, out), file=stream)
+        if len(inventory.regions) > 0:
+            print(file=stream)
+
+        self._apply(inventory, warning_threshold, critical_threshold, stop=stop, resource=resource, stream=stream,
+                    **kwargs)
+
+        return inventory
+
+    @staticmethod
+    def _batches(items, size):
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def _snapshot(func, *args, **kwargs):
+        """Call a snapshot store method, dropping the snapshot rather than the listing if it fails."""
+        run = kwargs.pop('run', None)
+        try:
+            return func(*args)
+        except Exception as e:
+            log.warning('Unable to save inventory snapshot: %s' % e)
+            if run is not None:
+                try:
+                    run.close(False)
+                except Exception as e:
+                    log.debug(e)
+            return False
+
+    def _apply(self, inventory, warning_threshold, critical_threshold, stop=False, resource='instance', stream=None,
+               *args, **kwargs):
+        for user, mail_type, region_ids, dept in inventory.alerts():
+            self._send_alert(
+                mail_type=mail_type,
+                user=user,
+                region_ids=region_ids,
+                name_dict=inventory.names,
+                uptime_dict=inventory.uptimes,
+                warning_threshold=warning_threshold,
+                critical_threshold=critical_threshold,
+                stop=stop,
+                dept=dept,
+                rg_dict=inventory.rgs,
+                resource=resource
+            )
+        self._dispatcher.flush(stream=stream, **kwargs)
+
+        if stop and len(inventory.stop) > 0:
+            self._stop_resources(inventory.stop, resource, stream)
+
+    def _stop_resources(self, stop_dict, resource='instance', stream=None):
+        pass
+
+    def _cached_instances(self, local_tz, now, state=None, tag=None):
+        return self._read_through_records('instances', lambda: self._instances(local_tz, now, state, tag), state, tag)
+
+    def list_regions(self, disable_border, disable_header, output='table', *args, **kwargs):
         table = prettytable.PrettyTable(['Region'], border=not disable_border, header=not disable_header,
                                         sortby='Region')
         table.align = 'l'
+        writer = get_writer(output, table)
         for region in self._regions:
-            table.add_row([region])
-        print(table)
+            writer.add([region])
+        writer.close()
 
     @staticmethod
     def _get_uptime(seconds):
-        y = divmod(seconds, 86400*364)
-        w = divmod(y[1], 86400*7)
-        d = divmod(w[1], 86400)
-        h = divmod(d[1], 3600)
-        m = divmod(h[1], 60)
-        s = m[1]
-        uptime = []
-        if y[0] > 0:
-            uptime.append('%dy' % y[0])
-        if w[0] > 0:
-            uptime.append('%dw' % w[0])
-        if d[0] > 0:
-            uptime.append('%dd' % d[0])
-        if h[0] > 0:
-            uptime.append('%dh' % h[0])
-        if m[0] > 0:
-            uptime.append('%dm' % m[0])
-        uptime.append('%ds' % s)
-        uptime = ' '.join(uptime)
-        return uptime
-
-    @staticmethod
-    def _date_diff(date1, date2):
-        diff = (date1 - date2)
-        diff = (diff.microseconds + (diff.seconds + diff.days * 24 * 3600) * 10 ** 6) / 10 ** 6
-        return diff
+        return get_uptime(seconds)
+
+    @classmethod
+    def _load_template(cls, mail_type):
+        if mail_type not in cls._templates:
+            with open(os.path.join(cls.TEMPLATE_DIR, '%s.txt' % mail_type)) as f:
+                cls._templates[mail_type] = Template(f.read())
+        return cls._templates[mail_type]
+
+    def _alert_context(self, warning_threshold, critical_threshold, stop, resource):
+        key = (warning_threshold, critical_threshold, stop, resource)
+        if key not in self._alert_contexts:
+            stop_term = 'STOPPED' if resource == 'instance' else 'DELETED'
+
+            if stop:
+                stop_msg = '\nANY RESOURCES RUNNING FOR LONGER THAN %s HOURS WILL BE %s IMMEDIATELY!\
+        \n\nPlease check your %s account and make sure there are no more offending resources.\n' % \
+                           (critical_threshold, stop_term, self._cloud_name)
+            else:
+                stop_msg = '\nPLEASE IMMEDIATELY STOP OR TERMINATE ANY RESOURCES THAT ARE NO LONGER IN USE!\n'
+
+            self._alert_contexts[key] = {
+                'cloud': self._cloud_name,
+                'warning_threshold': warning_threshold,
+                'critical_threshold': critical_threshold,
+                'bp_url': self._bp_url[self._cloud_name],
+                'stop_msg': stop_msg,
+                'resource': resource,
+                'stop_term': stop_term
+            }
+        return self._alert_contexts[key]
 
     def _send_alert(self, mail_type, user, region_ids, name_dict, uptime_dict, warning_threshold, critical_threshold,
                     stop=False, dept=None, rg_dict=None, resource='instance'):
         user_name = user.split('.')[0].capitalize()
         profiles = dept if dept else [self._profile_name.upper()]
 
-        number = 0
-
         if self._cloud_name == 'Azure':
             table = prettytable.PrettyTable(['Region', 'RG', 'Name', 'Uptime'])
-            for region, ids in region_ids.items():
-                number += len(ids)
-                for iid in ids:
-                    table.add_row([
-                        region,
-                        rg_dict[iid],
-                        name_dict[iid],
-                        uptime_dict[iid]
-                    ])
+            rows = [[region, rg_dict[iid], name_dict[iid], uptime_dict[iid]]
+                    for region, ids in region_ids.items() for iid in ids]
         else:
             table = prettytable.PrettyTable(['Region', 'Instance ID', 'Name', 'Uptime'])
-            for region, ids in region_ids.items():
-                number += len(ids)
-                for iid in ids:
-                    table.add_row([
-                        region,
-                        iid,
-                        name_dict[iid],
-                        uptime_dict[iid]
-                    ])
+            rows = [[region, iid, name_dict[iid], uptime_dict[iid]]
+                    for region, ids in region_ids.items() for iid in ids]
+        for row in rows:
+            table.add_row(row)
+        number = len(rows)
         table.align = 'l'
 
         if number > 1:
@@ -167,55 +455,166 @@ class WDCloud(object):
             if recipient in cc_recipient:
                 cc_recipient.remove(recipient)
 
-        if cc_recipient:
-            cc = ' (cc: %s)' % ', '.join(cc_recipient)
-        else:
-            cc = ''
-
         subject = '%s %s %s: running %ss' % (mail_type.upper(), self._cloud_name, '/'.join(profiles), resource)
 
-        stop_term = 'STOPPED' if resource == 'instance' else 'DELETED'
-
-        if stop:
-            stop_msg = '\nANY RESOURCES RUNNING FOR LONGER THAN %s HOURS WILL BE %s IMMEDIATELY!\
-        \n\nPlease check your %s account and make sure there are no more offending resources.\n' % \
-                       (critical_threshold, stop_term, self._cloud_name)
-        else:
-            stop_msg = '\nPLEASE IMMEDIATELY STOP OR TERMINATE ANY RESOURCES THAT ARE NO LONGER IN USE!\n'
-
-        template = open('%s/templates/%s.txt' % (os.path.dirname(os.path.realpath(__file__)), mail_type))
-        template = Template(template.read())
-        message = template.substitute({
+        values = dict(self._alert_context(warning_threshold, critical_threshold, stop, resource))
+        values.update({
             'user_name': user_name,
             'number': number,
             's': s,
-            'cloud': self._cloud_name,
             'profile': '/'.join(profiles),
             'ss': ss,
-            'table': table,
-            'warning_threshold': warning_threshold,
-            'critical_threshold': critical_threshold,
-            'bp_url': self._bp_url[self._cloud_name],
+            'table': table.get_string(),
             'some_of_them': some_of_them,
-            'stop_msg': stop_msg,
-            'have': have,
-            'resource': resource,
-            'stop_term': stop_term
+            'have': have
         })
-
-        print('Sending %s notification to %s%s... ' % (mail_type, recipient, cc), end='')
-        response = self._mailer.send(
-            sender=sender,
-            recipients=recipient,
-            subject=subject,
-            message=message,
-            code=True,
-            cc=cc_recipient
-        )
-        if response:
-            print('SUCCESS')
-        else:
-            print('FAIL')
+        message = self._load_template(mail_type).substitute(values)
+
+        self._dispatcher.queue(mail_type, sender, recipient, subject, message, cc_recipient,
+                               key='%s/%s/%s' % (self._cloud_name, '/'.join(profiles), resource),
+                               instances=[iid for ids in region_ids.values() for iid in ids])
+
+    def _map(self, func, items, workers=None):
+        return map_concurrently(func, items, workers or self.MAX_WORKERS)
+
+    def _pipeline(self, items, func, workers=None, maxsize=None):
+        workers = workers or self.MAX_WORKERS
+        maxsize = maxsize or workers * 2
+        input_queue = queue.Queue(maxsize)
+        output_queue = queue.Queue(maxsize)
+        done = object()
+        errors = []
+
+        def produce():
+            try:
+                for item in items:
+                    input_queue.put(item)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                for _ in range(workers):
+                    input_queue.put(done)
+
+        def work():
+            try:
+                while True:
+                    item = input_queue.get()
+                    if item is done:
+                        break
+                    try:
+                        output_queue.put(func(item))
+                    except Exception as e:
+                        errors.append(e)
+            finally:
+                output_queue.put(done)
+
+        for target in [produce] + [work] * workers:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+        finished = 0
+        while finished < workers:
+            result = output_queue.get()
+            if result is done:
+                finished += 1
+            else:
+                yield result
+
+        if errors:
+            raise errors[0]
+
+    def _cache_file(self, name):
+        return os.path.join(self.CACHE_DIR, '%s.json' % name)
+
+    def _load_cache(self, name):
+        try:
+            with open(self._cache_file(name)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            log.debug('Unable to load cache %s (%s)' % (name, e))
+            return None
+
+    def _save_cache(self, name, data):
+        cache_file = self._cache_file(name)
+        try:
+            if not os.path.isdir(self.CACHE_DIR):
+                os.makedirs(self.CACHE_DIR)
+            with open(cache_file + '.tmp', 'w') as f:
+                json.dump(data, f, default=str)
+            os.rename(cache_file + '.tmp', cache_file)
+        except (IOError, OSError) as e:
+            log.debug('Unable to save cache %s (%s)' % (name, e))
+            return False
+        return True
+
+    def _response_cache(self, name, *args):
+        if args:
+            name += '-' + hashlib.md5(json.dumps(args, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:8]
+        return 'response-%s-%s-%s' % (self._cloud_name.lower().replace('/', '_'), self._profile_name, name)
+
+    def _fresh_cache(self, name):
+        if self._refresh:
+            return None
+        data = self._load_cache(name)
+        if data and time.time() - data.get('saved_at', 0) < self._cache_ttl:
+            return data
+        if self._cached:
+            log.critical('Cached response %s is missing or older than %s seconds, run without --cached' %
+                         (name, self._cache_ttl))
+            exit(1)
+        return None
+
+    @contextlib.contextmanager
+    def _cache_lock(self, name):
+        if not os.path.isdir(self.CACHE_DIR):
+            os.makedirs(self.CACHE_DIR)
+        with open(self._cache_file(name) + '.lock', 'w') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_through(self, name, fetch, *args):
+        name = self._response_cache(name, *args)
+        data = self._fresh_cache(name)
+        if data is None:
+            with self._cache_lock(name):
+                data = self._fresh_cache(name)
+                if data is None:
+                    data = {'saved_at': time.time(), 'data': fetch()}
+                    self._save_cache(name, data)
+        return data['data']
+
+    def _read_through_records(self, name, fetch, *args):
+        name = self._response_cache(name, *args)
+        data = self._fresh_cache(name)
+        if data is None:
+            with self._cache_lock(name):
+                data = self._fresh_cache(name)
+                if data is None:
+                    self._replayed = False
+                    cache = CacheWriter(self._cache_file(name), time.time())
+                    complete = False
+                    try:
+                        for record in fetch():
+                            cache.add(dict((slot, getattr(record, slot)) for slot in Record.__slots__))
+                            yield record
+                        complete = True
+                    finally:
+                        cache.close(complete)
+                    return
+
+        elapsed = max(int(time.time() - data['saved_at']), 0)
+        self._replayed = True
+        for values in data['data']:
+            record = Record(**values)
+            if record.seconds is not None:
+                record.seconds += elapsed
+            yield record
 
     def _check_region(self, region):
         if region not in self._regions:
@@ -8,17 +8,16 @@ Copyright (C) 2019 WANdisco
 
 from __future__ import print_function
 import os
-import datetime
 import prettytable
-import tzlocal
 from oauth2client.client import GoogleCredentials, HttpAccessTokenRefreshError
 from googleapiclient import discovery, errors
-import iso8601
 
 from CONFIG import CONFIG
 import logging
 import time
-from wdcloud import WDCloud
+from wdcloud import WDCloud, Record
+from wdtime import Clock
+import wdtrace
 
 log = logging.getLogger('cloud_tools')
 
@@ -37,17 +36,19 @@ class GCP(WDCloud):
                 print('Credentials file %s does not exist.' % credentials_file)
                 exit(1)
         credentials = GoogleCredentials.get_application_default()
-        self._compute = discovery.build('compute', 'v1', credentials=credentials)
-        zones = None
-        try:
-            zones = self._compute.zones().list(project=self._project).execute()
-        except HttpAccessTokenRefreshError as e:
-            print('Auth Error (%s)' % e)
-            exit(1)
+        self._compute = discovery.build('compute', 'v1', credentials=credentials,
+                                        requestBuilder=wdtrace.google_request_builder())
 
-        for zone in zones['items']:
-            self._zones.append(zone['name'])
-            region = str(zone['name']).rsplit('-', 1)[0]
+        def list_zones():
+            try:
+                return [zone['name'] for zone in self._compute.zones().list(project=self._project).execute()['items']]
+            except HttpAccessTokenRefreshError as e:
+                print('Auth Error (%s)' % e)
+                exit(1)
+
+        for zone in self._read_through('zones', list_zones):
+            self._zones.append(zone)
+            region = str(zone).rsplit('-', 1)[0]
             if region not in self._regions:
                 self._regions.append(region)
 
@@ -63,24 +64,20 @@ class GCP(WDCloud):
 
     def list(self, disable_border=False, disable_header=False, state=None, notify=False, stop=False,
              warning_threshold=None, critical_threshold=None, tag=None, *args, **kwargs):
-        if not state:
-            state = ['running', 'staging', 'provisioning', 'stopping', 'terminated']
         table = prettytable.PrettyTable(['Region', 'Name', 'Type', 'Image', 'State', 'Creation time',
                                          'Launch time', 'Uptime', 'User', 'Private IP', 'Public IP',
                                          'Exclude'],
                                         border=not disable_border, header=not disable_header, reversesort=True,
                                         sortby='Launch time')
         table.align = 'l'
-        i = 0
-        states_dict = {}
-        uptime_dict = {}
-        name_dict = {}
-        stop_dict = {}
-        info_dict = {}
-        warning_dict = {}
-        critical_dict = {}
-        local_tz = tzlocal.get_localzone()
-        now = local_tz.localize(datetime.datetime.now())
+        local_tz, now = self._clock()
+        self._report(self._cached_instances(local_tz, now, state), table, local_tz, now, warning_threshold,
+                     critical_threshold, notify=notify, stop=stop, snapshot=not state, **kwargs)
+
+    def _instances(self, local_tz, now, state=None, *args, **kwargs):
+        if not state:
+            state = ['running', 'staging', 'provisioning', 'stopping', 'terminated']
+        clock = Clock(local_tz, now)
         for zone in self._zones:
             region = str(zone).rsplit('-', 1)[0]
             if region not in self._regions:
@@ -95,9 +92,7 @@ class GCP(WDCloud):
                 instance_state = str(instance.get('status')).lower()
                 if instance_state not in state:
                     continue
-                creation_time = instance.get('creationTimestamp')
-                creation_time = iso8601.parse_date(creation_time).astimezone(local_tz).strftime('%Y-%m-%d %H:%M:%S') \
-                    if creation_time else ''
+                creation_time = clock.local(clock.parse(instance.get('creationTimestamp')))
                 instance_name = instance.get('name')
                 instance_type = str(instance.get('machineType')).rsplit('/', 1)[1]
                 image_name = str(instance.get('disks')[0]['licenses'][0]).rsplit('/', 1)[1]
@@ -109,78 +104,39 @@ class GCP(WDCloud):
                 public_ip_address = public_ip_address or ''
                 last_user = self._operations_get(operations, instance_id, 'user')
                 last_user = str(last_user).split('@', 1)[0] if last_user else ''
-                launch_time = ''
-                launch_time_src = self._operations_get(operations, instance_id, 'endTime')
-                if launch_time_src:
-                    launch_time_src = iso8601.parse_date(launch_time_src).astimezone(local_tz)
-                    launch_time = launch_time_src.strftime('%Y-%m-%d %H:%M:%S')
-                uptime = ''
+                launched = clock.parse(self._operations_get(operations, instance_id, 'endTime'))
+                launch_time = clock.local(launched)
+                seconds = None
                 excluded = False
 
-                if instance_state == 'running' and launch_time_src:
-                    seconds = self._date_diff(now, launch_time_src)
-                    uptime = self._get_uptime(seconds)
-                    if seconds >= (critical_threshold * 3600) and not excluded:
-                        if region not in stop_dict:
-                            stop_dict[region] = []
-                        stop_dict[region].append(instance_id)
-                    if last_user and notify and not excluded:
-                        name_dict[instance_id] = instance_name
-                        uptime_dict[instance_id] = uptime
-                        if last_user not in info_dict:
-                            info_dict[last_user] = {}
-                        if region not in info_dict[last_user]:
-                            info_dict[last_user][region] = []
-                        info_dict[last_user][region].append(instance_id)
-
-                        if seconds >= (critical_threshold * 3600):
-                            critical_dict[last_user] = True
-                        elif seconds >= (warning_threshold * 3600):
-                            warning_dict[last_user] = True
-                i += 1
-                table.add_row([
-                    region,
-                    instance_name,
-                    instance_type,
-                    image_name,
-                    instance_state,
-                    creation_time,
-                    launch_time,
-                    uptime,
-                    last_user,
-                    private_ip_address,
-                    public_ip_address,
-                    excluded
-                ])
-                if instance_state in states_dict:
-                    states_dict[instance_state] += 1
-                else:
-                    states_dict[instance_state] = 1
-        print(table)
-        out = ', '.join(['%s: %s' % (key, value) for (key, value) in sorted(states_dict.items())])
-        if len(out) > 0:
-            out = '(%s)' % out
-        else:
-            out = ''
-        print('Time: %s (%s) | Instances: %s %s' % (now.strftime('%Y-%m-%d %H:%M:%S'), str(local_tz), i, out))
-        if len(info_dict) > 0:
-            print()
-
-        for user, region_ids in info_dict.items():
-            if user in critical_dict:
-                mail_type = 'critical'
-            elif user in warning_dict:
-                mail_type = 'warning'
-            else:
-                mail_type = 'info'
-            self._send_alert(mail_type,
-                             user,
-                             region_ids,
-                             name_dict,
-                             uptime_dict,
-                             warning_threshold,
-                             critical_threshold,
-                             stop)
+                if instance_state == 'running' and launched is not None:
+                    seconds = clock.seconds(launched)
+
+                yield Record(
+                    region=region,
+                    iid=instance_id,
+                    name=instance_name,
+                    user=last_user,
+                    state=instance_state,
+                    seconds=seconds,
+                    launch_time=launch_time,
+                    excluded=excluded,
+                    stop_key=region,
+                    row=[
+                        region,
+                        instance_name,
+                        instance_type,
+                        image_name,
+                        instance_state,
+                        creation_time,
+                        launch_time,
+                        '',
+                        last_user,
+                        private_ip_address,
+                        public_ip_address,
+                        excluded
+                    ]
+                )
 
     def run(self, region, subnet_id, image_id_list, ssh_key, count=1, instance_type=None, private_ip=None,
             volume_size=None, tag=None, user_data=None, name=None, *args, **kwargs):
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""This module provides notification dispatcher.
+
+Author: Peter Pakos <peter.pakos@wandisco.com>
+
+Copyright (C) 2019 WANdisco
+"""
+
+from __future__ import print_function
+import os
+import sqlite3
+import time
+from ppmail import Mailer
+import logging
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+log = logging.getLogger('cloud_tools')
+
+
+class NotificationStore(object):
+    SEVERITY = {
+        'info': 0,
+        'warning': 1,
+        'critical': 2
+    }
+
+    def __init__(self, path, windows):
+        self._path = path
+        self._windows = windows
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            if not os.path.isdir(os.path.dirname(self._path)):
+                os.makedirs(os.path.dirname(self._path))
+            self._db = sqlite3.connect(self._path)
+            self._db.execute('''CREATE TABLE IF NOT EXISTS notifications (
+                key TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                mail_type TEXT NOT NULL,
+                instances TEXT NOT NULL,
+                sent_at INTEGER NOT NULL,
+                PRIMARY KEY (key, recipient)
+            )''')
+        return self._db
+
+    def suppressed(self, key, recipient, mail_type, instances):
+        row = self._connect().execute(
+            'SELECT mail_type, instances, sent_at FROM notifications WHERE key = ? AND recipient = ?',
+            (key, recipient)
+        ).fetchone()
+        if not row:
+            return False
+        last_type, last_instances, sent_at = row
+        if self.SEVERITY.get(mail_type, 0) > self.SEVERITY.get(last_type, 0):
+            return False
+        if last_instances != ','.join(instances):
+            return False
+        return time.time() - sent_at < self._windows.get(mail_type, 0) * 3600
+
+    def record(self, key, recipient, mail_type, instances):
+        db = self._connect()
+        db.execute('INSERT OR REPLACE INTO notifications VALUES (?, ?, ?, ?, ?)',
+                   (key, recipient, mail_type, ','.join(instances), int(time.time())))
+        db.commit()
+
+
+class Dispatcher(object):
+    RETRIES = 3
+    RETRY_DELAY = 2
+
+    def __init__(self, workers=4, mailer=None, store=None):
+        self._workers = workers
+        self._store = store
+        self._messages = []
+        self._mailers = queue.Queue()
+        if mailer:
+            self._mailers.put(mailer)
+
+    def queue(self, mail_type, sender, recipient, subject, message, cc=None, key=None, instances=None):
+        self._messages.append({
+            'key': key,
+            'instances': sorted(instances or []),
+            'mail_type': mail_type,
+            'sender': sender,
+            'recipient': recipient,
+            'subject': subject,
+            'message': message,
+            'cc': cc or []
+        })
+
+    def _send(self, message):
+        try:
+            mailer = self._mailers.get_nowait()
+        except queue.Empty:
+            try:
+                mailer = Mailer(slack=True)
+            except Exception as e:
+                log.debug(e)
+                return False
+
+        try:
+            for attempt in range(1, self.RETRIES + 1):
+                try:
+                    if mailer.send(
+                        sender=message['sender'],
+                        recipients=message['recipient'],
+                        subject=message['subject'],
+                        message=message['message'],
+                        code=True,
+                        cc=message['cc']
+                    ):
+                        return True
+                except Exception as e:
+                    log.debug('Sending to %s failed (attempt %s): %s' % (message['recipient'], attempt, e))
+                if attempt < self.RETRIES:
+                    time.sleep(self.RETRY_DELAY * attempt)
+            return False
+        finally:
+            self._mailers.put(mailer)
+
+    @staticmethod
+    def _render(messages, render_dir):
+        if not os.path.isdir(render_dir):
+            os.makedirs(render_dir)
+        for i, message in enumerate(messages, 1):
+            with open(os.path.join(render_dir, '%03d-%s-%s.txt' % (i, message['mail_type'], message['recipient'])),
+                      'w') as f:
+                f.write('From: %s\nTo: %s\nCc: %s\nSubject: %s\n\n%s' % (
+                    message['sender'],
+                    message['recipient'],
+                    ', '.join(message['cc']),
+                    message['subject'],
+                    message['message']
+                ))
+        log.info('Rendered %s notifications to %s' % (len(messages), render_dir))
+
+    def flush(self, render_dir=None, resend=False, stream=None, *args, **kwargs):
+        messages, self._messages = self._messages, []
+
+        if self._store and not resend:
+            pending = []
+            for message in messages:
+                if message['key'] and self._store.suppressed(message['key'], message['recipient'],
+                                                             message['mail_type'], message['instances']):
+                    print('Suppressing %s notification to %s (already sent)' %
+                          (message['mail_type'], message['recipient']), file=stream)
+                else:
+                    pending.append(message)
+            messages = pending
+
+        if not messages:
+            return 0, 0
+
+        if render_dir:
+            self._render(messages, render_dir)
+
+        from wdcloud import map_concurrently
+        results = map_concurrently(self._send, messages, self._workers)
+
+        for message, response in zip(messages, results):
+            cc = ' (cc: %s)' % ', '.join(message['cc']) if message['cc'] else ''
+            print('Sending %s notification to %s%s... %s' %
+                  (message['mail_type'], message['recipient'], cc, 'SUCCESS' if response else 'FAIL'), file=stream)
+
+        if self._store:
+            for message, response in zip(messages, results):
+                if response and message['key']:
+                    self._store.record(message['key'], message['recipient'], message['mail_type'],
+                                       message['instances'])
+
+        sent = len([response for response in results if response])
+        print('Notifications: %s sent, %s failed' % (sent, len(results) - sent), file=stream)
+        return sent, len(results) - sent
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""This module provides output writers for listing commands.
+
+Author: Peter Pakos <peter.pakos@wandisco.com>
+
+Copyright (C) 2019 WANdisco
+"""
+
+from __future__ import print_function
+import sys
+import abc
+import csv
+import json
+from collections import OrderedDict
+
+FORMATS = ['table', 'json', 'ndjson', 'csv']
+
+
+class Writer(object):
+    __metaclass__ = abc.ABCMeta
+    machine = True
+    streaming = False
+
+    def __init__(self, table, stream=None):
+        self._table = table
+        self._fields = table.field_names
+        self._stream = stream or sys.stdout
+
+    @property
+    def log_stream(self):
+        return sys.stderr if self.machine else self._stream
+
+    def _dict(self, row):
+        return OrderedDict(zip(self._fields, row))
+
+    @abc.abstractmethod
+    def add(self, row):
+        pass
+
+    def close(self):
+        pass
+
+
+class TableWriter(Writer):
+    machine = False
+
+    def add(self, row):
+        self._table.add_row(row)
+
+    def close(self):
+        print(self._table, file=self._stream)
+
+
+class JSONWriter(Writer):
+    def __init__(self, *args, **kwargs):
+        super(JSONWriter, self).__init__(*args, **kwargs)
+        self._rows = []
+
+    def add(self, row):
+        self._rows.append(self._dict(row))
+
+    def close(self):
+        if self._table.sortby:
+            self._rows.sort(key=lambda r: str(r[self._table.sortby]), reverse=self._table.reversesort)
+        json.dump(self._rows, self._stream, indent=2, default=str)
+        self._stream.write('\n')
+
+
+class NDJSONWriter(Writer):
+    streaming = True
+
+    def add(self, row):
+        self._stream.write(json.dumps(self._dict(row), default=str) + '\n')
+        self._stream.flush()
+
+
+class CSVWriter(Writer):
+    streaming = True
+
+    def __init__(self, *args, **kwargs):
+        super(CSVWriter, self).__init__(*args, **kwargs)
+        self._writer = csv.writer(self._stream)
+        self._writer.writerow(self._fields)
+
+    def add(self, row):
+        self._writer.writerow(row)
+
+
+def get_writer(output, table, stream=None):
+    writers = {
+        'table': TableWriter,
+        'json': JSONWriter,
+        'ndjson': NDJSONWriter,
+        'csv': CSVWriter
+    }
+    return writers[output or 'table'](table, stream)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""This module provides local inventory snapshot store.
+
+Author: Peter Pakos <peter.pakos@wandisco.com>
+
+Copyright (C) 2019 WANdisco
+"""
+
+from __future__ import print_function
+import os
+import sqlite3
+import time
+import datetime
+import prettytable
+from wdoutput import get_writer
+import logging
+
+log = logging.getLogger('cloud_tools')
+
+
+class SnapshotStore(object):
+    def __init__(self, path, retention_days=None):
+        self._path = path
+        self._retention_days = retention_days
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            if not os.path.isdir(os.path.dirname(self._path)):
+                os.makedirs(os.path.dirname(self._path))
+            self._db = sqlite3.connect(self._path)
+            self._db.executescript('''
+                CREATE TABLE IF NOT EXISTS runs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    cloud TEXT NOT NULL,
+                    profile TEXT NOT NULL,
+                    resource TEXT NOT NULL,
+                    taken_at INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS runs_key ON runs (cloud, profile, resource, taken_at);
+                CREATE TABLE IF NOT EXISTS instances (
+                    run_id INTEGER NOT NULL,
+                    region TEXT,
+                    iid TEXT NOT NULL,
+                    name TEXT,
+                    user TEXT,
+                    state TEXT,
+                    seconds INTEGER,
+                    launch_time TEXT,
+                    active INTEGER NOT NULL,
+                    excluded INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS instances_run ON instances (run_id);
+                CREATE INDEX IF NOT EXISTS instances_iid ON instances (iid);
+                CREATE INDEX IF NOT EXISTS instances_user ON instances (user);
+                CREATE INDEX IF NOT EXISTS instances_state ON instances (state);
+            ''')
+        return self._db
+
+    def start(self, cloud, profile, resource, taken_at=None):
+        return SnapshotRun(self, cloud, profile, resource, int(taken_at or time.time()))
+
+    def save(self, cloud, profile, resource, records, taken_at=None):
+        run = self.start(cloud, profile, resource, taken_at)
+        try:
+            for record in records:
+                run.add(record)
+        except Exception:
+            run.close(False)
+            raise
+        return run.close()
+
+    def _write(self, run, rows):
+        db = self._connect()
+        with db:
+            run_id = db.execute('INSERT INTO runs (cloud, profile, resource, taken_at) VALUES (?, ?, ?, ?)',
+                                run).lastrowid
+            db.executemany('INSERT INTO instances VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                           ((run_id,) + row for row in rows))
+            if self._retention_days:
+                expired = run[3] - self._retention_days * 86400
+                db.execute('DELETE FROM instances WHERE run_id IN (SELECT id FROM runs WHERE taken_at < ?)',
+                           (expired,))
+                db.execute('DELETE FROM runs WHERE taken_at < ?', (expired,))
+        return run_id
+
+    def runs(self, cloud, profile, resource, before=None, limit=2):
+        return self._connect().execute(
+            'SELECT id, taken_at FROM runs WHERE cloud = ? AND profile = ? AND resource = ? AND taken_at <= ? '
+            'ORDER BY taken_at DESC, id DESC LIMIT ?',
+            (cloud, profile, resource, int(before or time.time()), limit)
+        ).fetchall()
+
+    def instances(self, run_id):
+        return dict((row[1], row) for row in self._connect().execute(
+            'SELECT region, iid, name, user, state, active FROM instances WHERE run_id = ?', (run_id,)
+        ))
+
+    def trend(self, cloud, profile, resource, since, user=None):
+        query = ("SELECT date(r.taken_at, 'unixepoch', 'localtime') AS day, i.user, COUNT(DISTINCT r.id), "
+                 "COUNT(DISTINCT i.iid), MAX(i.seconds) FROM runs r JOIN instances i ON i.run_id = r.id "
+                 "WHERE r.cloud = ? AND r.profile = ? AND r.resource = ? AND r.taken_at >= ? AND i.active = 1")
+        params = [cloud, profile, resource, int(since)]
+        if user:
+            query += ' AND i.user = ?'
+            params.append(user)
+        query += ' GROUP BY day, i.user ORDER BY day, i.user'
+        return self._connect().execute(query, params).fetchall()
+
+
+class SnapshotRun(object):
+    """Snapshot of a single listing, collected as records stream in and written in one transaction on close.
+
+    Rows are kept as compact tuples so that no write lock is held on the store while the listing is fetched.
+    """
+
+    def __init__(self, store, cloud, profile, resource, taken_at):
+        self._store = store
+        self._run = (cloud, profile, resource, taken_at)
+        self._rows = []
+
+    def add(self, r):
+        self._rows.append((r.region, str(r.iid), r.name, r.user, r.state, r.seconds, str(r.launch_time),
+                           int(bool(r.active)), int(bool(r.excluded))))
+
+    def close(self, commit=True):
+        rows, self._rows = self._rows, []
+        if not commit:
+            return None
+        return self._store._write(self._run, rows)
+
+
+class Snapshots(object):
+    def __init__(self, store, cloud_name, profile_name):
+        self._store = store
+        self._cloud_name = cloud_name
+        self._profile_name = profile_name
+
+    @staticmethod
+    def _time(timestamp):
+        return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+    def history(self, disable_border=False, disable_header=False, resource='instance', user=None, days=7,
+                output='table', *args, **kwargs):
+        table = prettytable.PrettyTable(['Date', 'User', 'Runs', 'Running', 'Max uptime (h)'],
+                                        border=not disable_border, header=not disable_header)
+        table.align = 'l'
+        writer = get_writer(output, table)
+        rows = self._store.trend(self._cloud_name, self._profile_name, resource, time.time() - days * 86400, user)
+        for day, owner, runs, running, seconds in rows:
+            writer.add([day, owner, runs, running, round((seconds or 0) / 3600.0, 1)])
+        writer.close()
+        print('[%s/%s] %s history: %s days' % (self._cloud_name, self._profile_name, resource, days),
+              file=writer.log_stream)
+
+    def diff(self, disable_border=False, disable_header=False, resource='instance', since=None, output='table',
+             *args, **kwargs):
+        runs = self._store.runs(self._cloud_name, self._profile_name, resource)
+        if since and runs:
+            runs = runs[:1] + self._store.runs(self._cloud_name, self._profile_name, resource,
+                                               before=runs[0][1] - since * 3600, limit=1)
+        if len(runs) < 2:
+            log.critical('Not enough %s snapshots for %s/%s, run list first' %
+                         (resource, self._cloud_name, self._profile_name))
+            exit(1)
+
+        (current_id, current_at), (previous_id, previous_at) = runs[0], runs[1]
+        current = self._store.instances(current_id)
+        previous = self._store.instances(previous_id)
+
+        table = prettytable.PrettyTable(['Change', 'Region', 'ID', 'Name', 'User', 'Before', 'After'],
+                                        border=not disable_border, header=not disable_header, sortby='Change')
+        table.align = 'l'
+        writer = get_writer(output, table)
+        changes = {}
+        for iid in sorted(set(current) | set(previous)):
+            before = previous.get(iid)
+            after = current.get(iid)
+            if after and after[5] and not (before and before[5]):
+                change = 'started'
+            elif before and before[5] and not (after and after[5]):
+                change = 'stopped' if after else 'removed'
+            elif after and not before:
+                change = 'added'
+            elif before and not after:
+                change = 'removed'
+            elif before[4] != after[4]:
+                change = 'changed'
+            else:
+                continue
+            row = after or before
+            changes[change] = changes.get(change, 0) + 1
+            writer.add([change, row[0], row[1], row[2], row[3], before[4] if before else '',
+                        after[4] if after else ''])
+        writer.close()
+
+        out = ', '.join(['%s: %s' % (key, value) for (key, value) in sorted(changes.items())])
+        print('[%s/%s] %s -> %s | Changes: %s' % (self._cloud_name, self._profile_name, self._time(previous_at),
+                                                  self._time(current_at), out or 'none'),
+              file=writer.log_stream)
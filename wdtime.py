@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""This module provides timestamp normalisation.
+
+Author: Peter Pakos <peter.pakos@wandisco.com>
+
+Copyright (C) 2019 WANdisco
+"""
+
+import re
+import time
+import calendar
+import datetime
+import iso8601
+import tzlocal
+
+ISO_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:\.\d+)?(?:(Z)|([+-])(\d{2}):?(\d{2}))?$')
+
+
+class LocalTime(object):
+    __slots__ = ['epoch', '_clock', '_text']
+
+    def __init__(self, epoch, clock):
+        self.epoch = epoch
+        self._clock = clock
+        self._text = None
+
+    def __str__(self):
+        if self._text is None:
+            self._text = self._clock.format(self.epoch)
+        return self._text
+
+    def __repr__(self):
+        return 'LocalTime(%s)' % self
+
+    def __hash__(self):
+        return hash(self.epoch)
+
+    def __eq__(self, other):
+        return self.epoch == other.epoch if isinstance(other, LocalTime) else str(self) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        return self.epoch < other.epoch if isinstance(other, LocalTime) else str(self) < other
+
+    def __le__(self, other):
+        return self.epoch <= other.epoch if isinstance(other, LocalTime) else str(self) <= other
+
+    def __gt__(self, other):
+        return self.epoch > other.epoch if isinstance(other, LocalTime) else str(self) > other
+
+    def __ge__(self, other):
+        return self.epoch >= other.epoch if isinstance(other, LocalTime) else str(self) >= other
+
+
+class Clock(object):
+    OFFSET_BUCKET = 900
+
+    def __init__(self, local_tz=None, now=None):
+        self.local_tz = local_tz or tzlocal.get_localzone()
+        self.now = now or datetime.datetime.now(self.local_tz)
+        self.now_epoch = self.parse(self.now)
+        self._offsets = {}
+
+    @staticmethod
+    def parse(value):
+        """Return epoch seconds of a datetime or ISO 8601 string, None if empty."""
+        if not value:
+            return None
+        if isinstance(value, datetime.datetime):
+            if value.tzinfo is None:
+                return calendar.timegm(value.timetuple())
+            return calendar.timegm(value.utctimetuple())
+        match = ISO_RE.match(value)
+        if match:
+            epoch = calendar.timegm([int(part) for part in match.group(1, 2, 3, 4, 5, 6)])
+            if match.group(8):
+                offset = int(match.group(9)) * 3600 + int(match.group(10)) * 60
+                epoch += -offset if match.group(8) == '+' else offset
+            return epoch
+        return Clock.parse(iso8601.parse_date(value))
+
+    def seconds(self, epoch):
+        return self.now_epoch - epoch
+
+    def offset(self, epoch):
+        bucket = epoch // self.OFFSET_BUCKET
+        if bucket not in self._offsets:
+            delta = datetime.datetime.fromtimestamp(bucket * self.OFFSET_BUCKET, self.local_tz).utcoffset()
+            self._offsets[bucket] = delta.days * 86400 + delta.seconds
+        return self._offsets[bucket]
+
+    def format(self, epoch):
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(epoch + self.offset(epoch)))
+
+    def local(self, epoch):
+        return LocalTime(epoch, self) if epoch is not None else ''
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""This module provides API call tracing.
+
+Author: Peter Pakos <peter.pakos@wandisco.com>
+
+Copyright (C) 2019 WANdisco
+"""
+
+from __future__ import print_function
+import os
+import re
+import sys
+import json
+import time
+import threading
+import prettytable
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+import logging
+
+log = logging.getLogger('cloud_tools')
+
+AWS_REGION_RE = re.compile(r'\.([a-z]{2}(?:-[a-z]+)+-\d)\.amazonaws\.com')
+GCP_REGION_RE = re.compile(r'/(?:zones|regions)/([^/?]+)')
+
+_tracer = None
+_request_builder = None
+
+
+class Call(object):
+    __slots__ = ['service', 'operation', 'region', 'started', 'elapsed', 'retries', 'sent', 'received', 'status',
+                 'error', 'thread']
+
+    def __init__(self, service, operation, region, started, elapsed, retries=0, sent=0, received=0, status=None,
+                 error=None):
+        self.service = service
+        self.operation = operation
+        self.region = region or ''
+        self.started = started
+        self.elapsed = elapsed
+        self.retries = retries
+        self.sent = sent
+        self.received = received
+        self.status = status
+        self.error = error
+        self.thread = threading.current_thread().ident
+
+
+class Tracer(object):
+    def __init__(self, command):
+        self.command = command
+        self.started = time.time()
+        self.finished = None
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def record(self, *args, **kwargs):
+        call = Call(*args, **kwargs)
+        with self._lock:
+            self.calls.append(call)
+        log.debug('API call %s.%s (%s) %.0fms' % (call.service, call.operation, call.region, call.elapsed * 1000))
+
+    def summary(self):
+        table = prettytable.PrettyTable(['Service', 'Operation', 'Region', 'Calls', 'Errors', 'Retries', 'Total ms',
+                                         'Avg ms', 'Max ms', 'Sent', 'Received'], sortby='Total ms', reversesort=True)
+        table.align = 'r'
+        for column in ['Service', 'Operation', 'Region']:
+            table.align[column] = 'l'
+        groups = {}
+        for call in self.calls:
+            groups.setdefault((call.service, call.operation, call.region), []).append(call)
+        for (service, operation, region), calls in groups.items():
+            elapsed = [call.elapsed * 1000 for call in calls]
+            table.add_row([service, operation, region, len(calls), len([call for call in calls if call.error]),
+                           sum([call.retries for call in calls]), int(round(sum(elapsed))),
+                           int(round(sum(elapsed) / len(calls))), int(round(max(elapsed))),
+                           sum([call.sent for call in calls]), sum([call.received for call in calls])])
+        return table
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        events = [{
+            'name': self.command,
+            'cat': 'command',
+            'ph': 'X',
+            'ts': 0,
+            'dur': int(((self.finished or time.time()) - self.started) * 10 ** 6),
+            'pid': pid,
+            'tid': threading.current_thread().ident
+        }]
+        for call in self.calls:
+            events.append({
+                'name': '%s.%s' % (call.service, call.operation),
+                'cat': call.service,
+                'ph': 'X',
+                'ts': int((call.started - self.started) * 10 ** 6),
+                'dur': int(call.elapsed * 10 ** 6),
+                'pid': pid,
+                'tid': call.thread,
+                'args': {
+                    'region': call.region,
+                    'retries': call.retries,
+                    'sent': call.sent,
+                    'received': call.received,
+                    'status': call.status,
+                    'error': call.error
+                }
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'command': self.command}}
+
+    def report(self, path=None, stream=None):
+        self.finished = time.time()
+        stream = stream or sys.stderr
+        print(self.summary(), file=stream)
+        print('Command: %s | Time: %.2fs | API calls: %s | Time in API calls: %.2fs' % (
+            self.command, self.finished - self.started, len(self.calls),
+            sum([call.elapsed for call in self.calls])), file=stream)
+        if path:
+            with open(path, 'w') as f:
+                json.dump(self.chrome_trace(), f)
+            print('Trace written to %s' % path, file=stream)
+
+
+def start(command):
+    global _tracer
+    _tracer = Tracer(command)
+    return _tracer
+
+
+def stop(path=None):
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer:
+        tracer.report(path)
+    return tracer
+
+
+def _size(body):
+    if isinstance(body, (bytes, type(u''))):
+        return len(body)
+    return 0
+
+
+def instrument_boto3(session):
+    """Register event handlers tracing every API call made by clients of a boto3 session."""
+    if _tracer is None:
+        return
+
+    def before_call(model, context, event_name=None, **kwargs):
+        context['trace'] = {'service': event_name.split('.')[1], 'started': time.time(), 'attempts': 0, 'sent': 0,
+                            'region': context.get('client_region')}
+
+    def request_created(request, **kwargs):
+        trace = getattr(request, 'context', {}).get('trace')
+        if trace is not None:
+            trace['attempts'] += 1
+            trace['sent'] += _size(request.body)
+            if not trace['region']:
+                match = AWS_REGION_RE.search(request.url)
+                trace['region'] = match.group(1) if match else ''
+
+    def after_call(http_response, parsed, model, context, **kwargs):
+        trace = context.get('trace')
+        if trace is None or _tracer is None:
+            return
+        if model.has_streaming_output or http_response.raw is None:
+            received = int(http_response.headers.get('content-length', 0))
+        else:
+            received = len(http_response.content)
+        _tracer.record(trace['service'], model.name, trace['region'], trace['started'],
+                       time.time() - trace['started'], retries=max(trace['attempts'] - 1, 0), sent=trace['sent'],
+                       received=received, status=http_response.status_code,
+                       error=parsed.get('Error', {}).get('Code') if http_response.status_code >= 300 else None)
+
+    def after_call_error(exception, context, event_name=None, **kwargs):
+        trace = context.get('trace')
+        if trace is None or _tracer is None:
+            return
+        _tracer.record(trace['service'], event_name.split('.')[2], trace['region'], trace['started'],
+                       time.time() - trace['started'], retries=max(trace['attempts'] - 1, 0), sent=trace['sent'],
+                       error=type(exception).__name__)
+
+    session.events.register('before-call.*.*', before_call)
+    session.events.register('request-created.*.*', request_created)
+    session.events.register('after-call.*.*', after_call)
+    session.events.register('after-call-error.*.*', after_call_error)
+
+
+def google_request_builder():
+    """Return the googleapiclient request class, tracing each executed request while a tracer is running."""
+    global _request_builder
+    from googleapiclient.http import HttpRequest
+    if _tracer is None:
+        return HttpRequest
+    if _request_builder is None:
+        class CountingHttp(object):
+            def __init__(self, http):
+                self.http = http
+                self.attempts = 0
+                self.received = 0
+                self.status = None
+
+            def request(self, *args, **kwargs):
+                self.attempts += 1
+                resp, content = self.http.request(*args, **kwargs)
+                self.received += _size(content)
+                self.status = resp.status
+                return resp, content
+
+            def __getattr__(self, name):
+                return getattr(self.http, name)
+
+        class TracedHttpRequest(HttpRequest):
+            def execute(self, http=None, num_retries=0):
+                http = CountingHttp(http or self.http)
+                started = time.time()
+                error = None
+                try:
+                    return super(TracedHttpRequest, self).execute(http=http, num_retries=num_retries)
+                except Exception as e:
+                    error = type(e).__name__
+                    raise
+                finally:
+                    if _tracer is not None:
+                        service, _, operation = str(self.methodId).partition('.')
+                        match = GCP_REGION_RE.search(self.uri)
+                        _tracer.record(service, operation, match.group(1) if match else '', started,
+                                       time.time() - started, retries=max(http.attempts - 1, 0),
+                                       sent=_size(self.body), received=http.received, status=http.status,
+                                       error=error)
+
+        _request_builder = TracedHttpRequest
+    return _request_builder
+
+
+def _azure_operation(method, path):
+    if '/providers/' in path:
+        service, _, path = path.rpartition('/providers/')[2].partition('/')
+    else:
+        service, path = 'Microsoft.Resources', path.lstrip('/')
+    types = path.split('/')[::2]
+    return service, '%s %s' % (method, '/'.join(types))
+
+
+def instrument_azure(*clients):
+    """Add a response hook tracing every HTTP call made by msrest based Azure clients."""
+    if _tracer is None:
+        return
+
+    def hook(response, *args, **kwargs):
+        if _tracer is None:
+            return
+        request = response.request
+        service, operation = _azure_operation(request.method, urlparse(request.url).path)
+        retries = getattr(getattr(response.raw, 'retries', None), 'history', None) or ()
+        elapsed = response.elapsed.total_seconds()
+        _tracer.record(service, operation, '', time.time() - elapsed, elapsed, retries=len(retries),
+                       sent=_size(request.body), received=len(response.content), status=response.status_code,
+                       error=response.reason if response.status_code >= 400 else None)
+
+    for client in clients:
+        config = getattr(client, 'config', None)
+        if config is not None:
+            config.hooks.append(hook)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""This module provides uptime formatting and threshold classification.
+
+Author: Peter Pakos <peter.pakos@wandisco.com>
+
+Copyright (C) 2019 WANdisco
+"""
+
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+YEAR = 86400 * 364
+WEEK = 86400 * 7
+DAY = 86400
+HOUR = 3600
+MINUTE = 60
+NUMPY_MIN = 64
+
+
+def format_uptime(y, w, d, h, m, s):
+    uptime = []
+    if y > 0:
+        uptime.append('%dy' % y)
+    if w > 0:
+        uptime.append('%dw' % w)
+    if d > 0:
+        uptime.append('%dd' % d)
+    if h > 0:
+        uptime.append('%dh' % h)
+    if m > 0:
+        uptime.append('%dm' % m)
+    uptime.append('%ds' % s)
+    return ' '.join(uptime)
+
+
+def get_uptime(seconds):
+    y, r = divmod(int(math.floor(seconds)), YEAR)
+    w, r = divmod(r, WEEK)
+    d, r = divmod(r, DAY)
+    h, r = divmod(r, HOUR)
+    m, s = divmod(r, MINUTE)
+    return format_uptime(y, w, d, h, m, s)
+
+
+def get_uptimes(seconds, use_numpy=True):
+    """Return uptime strings for a sequence of seconds, None meaning inactive."""
+    if numpy is not None and use_numpy and len(seconds) >= NUMPY_MIN:
+        values = numpy.fromiter((s or 0 for s in seconds), dtype=numpy.float64, count=len(seconds))
+        y, r = numpy.divmod(numpy.floor(values).astype(numpy.int64), YEAR)
+        w, r = numpy.divmod(r, WEEK)
+        d, r = numpy.divmod(r, DAY)
+        h, r = numpy.divmod(r, HOUR)
+        m, s = numpy.divmod(r, MINUTE)
+        return [format_uptime(*parts) if value is not None else ''
+                for parts, value in zip(zip(y.tolist(), w.tolist(), d.tolist(), h.tolist(), m.tolist(), s.tolist()),
+                                        seconds)]
+    return [get_uptime(value) if value is not None else '' for value in seconds]
+
+
+class Classifier(object):
+    SEVERITY = ['info', 'warning', 'critical']
+
+    def __init__(self, warning_threshold, critical_threshold, use_numpy=True):
+        self.warning_seconds = warning_threshold * 3600
+        self.critical_seconds = critical_threshold * 3600
+        self._use_numpy = use_numpy
+
+    def severity(self, seconds):
+        if seconds >= self.critical_seconds:
+            return 2
+        if seconds >= self.warning_seconds:
+            return 1
+        return 0
+
+    def severities(self, seconds):
+        """Return severity buckets for a sequence of seconds, None meaning inactive."""
+        if numpy is not None and self._use_numpy and len(seconds) >= NUMPY_MIN:
+            values = numpy.fromiter((-1 if s is None else s for s in seconds), dtype=numpy.float64,
+                                    count=len(seconds))
+            buckets = numpy.where(values >= self.critical_seconds, 2,
+                                  numpy.where(values >= self.warning_seconds, 1, 0))
+            return [bucket if value is not None else None for bucket, value in zip(buckets.tolist(), seconds)]
+        warning_seconds = self.warning_seconds
+        critical_seconds = self.critical_seconds
+        return [None if s is None else 2 if s >= critical_seconds else 1 if s >= warning_seconds else 0
+                for s in seconds]
+
+    def classify(self, seconds):
+        """Return uptime strings and severity buckets for a whole inventory in one pass."""
+        return get_uptimes(seconds, self._use_numpy), self.severities(seconds)
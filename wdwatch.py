@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""This module provides Watcher class polling inventory in a loop.
+
+Author: Peter Pakos <peter.pakos@wandisco.com>
+
+Copyright (C) 2019 WANdisco
+"""
+
+from __future__ import print_function
+import time
+import json
+import threading
+from wdcloud import Inventory
+from wduptime import Classifier
+import logging
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+log = logging.getLogger('cloud_tools')
+
+
+class Watcher(object):
+    def __init__(self, cloud, interval, warning_threshold, critical_threshold, notify=False, stop=False):
+        self._cloud = cloud
+        self._interval = interval
+        self._warning_threshold = warning_threshold
+        self._critical_threshold = critical_threshold
+        self._notify = notify
+        self._stop = stop
+        self._classifier = Classifier(warning_threshold, critical_threshold)
+        self._levels = {}
+        self._lock = threading.Lock()
+        self._state = {
+            'cloud': cloud._cloud_name,
+            'profile': cloud._profile_name,
+            'interval': interval,
+            'polls': 0,
+            'updated_at': None,
+            'count': 0,
+            'states': {},
+            'instances': []
+        }
+
+    def poll(self, *args, **kwargs):
+        local_tz, now = self._cloud._clock()
+        records = list(self._cloud._cached_instances(local_tz, now))
+        uptimes, severities = self._classifier.classify([record.seconds for record in records])
+
+        levels = {}
+        changed = set()
+        users = set()
+        states = {}
+        instances = []
+        for record, uptime, level in zip(records, uptimes, severities):
+            key = (record.region, record.iid)
+            record.uptime = uptime
+            if not record.active or record.excluded:
+                level = None
+            levels[key] = level
+            if level is not None and (self._levels.get(key) is None or level > self._levels[key]):
+                changed.add(key)
+                if record.user:
+                    users.add(record.user)
+            states[record.state] = states.get(record.state, 0) + 1
+            instances.append({
+                'region': record.region,
+                'id': record.iid,
+                'name': record.name,
+                'user': record.user,
+                'state': record.state,
+                'launch_time': record.launch_time,
+                'uptime': record.uptime,
+                'excluded': record.excluded,
+                'severity': Inventory.SEVERITY[level] if level is not None else None
+            })
+        self._levels = levels
+
+        if changed:
+            inventory = Inventory(self._warning_threshold, self._critical_threshold, self._notify)
+            for record in records:
+                if (record.region, record.iid) in changed or record.user in users:
+                    inventory.add(record, levels[(record.region, record.iid)])
+            self._cloud._apply(inventory, self._warning_threshold, self._critical_threshold, stop=self._stop,
+                               **kwargs)
+
+        with self._lock:
+            self._state.update({
+                'polls': self._state['polls'] + 1,
+                'updated_at': now.strftime('%Y-%m-%d %H:%M:%S'),
+                'count': len(records),
+                'states': states,
+                'instances': instances
+            })
+
+        log.info('Time: %s | Instances: %s | Crossed thresholds: %s' %
+                 (now.strftime('%Y-%m-%d %H:%M:%S'), len(records), len(changed)))
+        return changed
+
+    def state(self):
+        with self._lock:
+            return json.dumps(self._state, default=str)
+
+    def serve(self, bind, port):
+        watcher = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ['/', '/state']:
+                    self.send_error(404)
+                    return
+                body = watcher.state().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                log.debug(fmt % args)
+
+        server = HTTPServer((bind, port), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        log.info('Serving state on http://%s:%s/' % (bind, server.server_address[1]))
+        return server
+
+    def run(self, bind='127.0.0.1', port=None, *args, **kwargs):
+        if port is not None:
+            self.serve(bind, port)
+        while True:
+            started = time.time()
+            try:
+                self.poll(**kwargs)
+            except Exception as e:
+                log.error('Poll failed: %s' % e)
+            time.sleep(max(0, self._interval - (time.time() - started)))